@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from vector import embeddings
+import os
+import threading
+import numpy as np
+
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95)) # Minimum cosine similarity for a hit.
+ANSWER_CACHE_MAX_ENTRIES_PER_CHAT = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES_PER_CHAT", 256)) # Answers kept per chat before LRU eviction.
+
+class SemanticAnswerCache:
+    """Per-chat cache of generated answers, looked up by the cosine similarity of question embeddings.
+
+    Every chat has an index version that is bumped whenever documents are indexed into it. Bumping
+    drops the chat's entries, and answers generated against an older version are never stored.
+    """
+
+    def __init__(self, embedding_function, threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD, max_entries_per_chat=ANSWER_CACHE_MAX_ENTRIES_PER_CHAT):
+        self.embedding_function = embedding_function
+        self.threshold = threshold
+        self.max_entries_per_chat = max_entries_per_chat
+        self.entries = {} # Maps chat ID -> OrderedDict of question -> (unit vector, answer, sources), oldest first.
+        self.versions = {} # Maps chat ID -> index version.
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def embed(self, question):
+        """Returns the unit-length embedding of a question."""
+        return self.normalize(self.embedding_function.embed_query(question))
+
+    def normalize(self, vector):
+        """Returns an embedding scaled to unit length."""
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, chat_id, question, vector=None):
+        """Finds the most similar cached question of a chat, embedding the question unless its `vector` is given.
+
+        Returns (hit, vector, version): `hit` is a dict with the cached answer, sources and similarity, or
+        None on a miss; `vector` and `version` are what `store` needs to cache a freshly generated answer.
+        """
+        vector = self.embed(question) if vector is None else self.normalize(vector)
+        with self.lock:
+            version = self.versions.get(chat_id, 0)
+            chat_entries = self.entries.get(chat_id)
+            best_question, best_similarity = None, -1.0
+            if chat_entries:
+                questions = list(chat_entries)
+                similarities = np.stack([chat_entries[q][0] for q in questions]) @ vector
+                best = int(np.argmax(similarities))
+                best_question, best_similarity = questions[best], float(similarities[best])
+
+            if best_question is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None, vector, version
+
+            self.hits += 1
+            chat_entries.move_to_end(best_question)
+            _, answer, sources = chat_entries[best_question]
+            return {"question": best_question, "answer": answer, "sources": sources, "similarity": round(best_similarity, 4)}, vector, version
+
+    def store(self, chat_id, question, vector, answer, sources, version):
+        """Caches an answer unless the chat's documents changed since `version` was read."""
+        with self.lock:
+            if self.versions.get(chat_id, 0) != version:
+                return
+            chat_entries = self.entries.setdefault(chat_id, OrderedDict())
+            chat_entries.pop(question, None)
+            chat_entries[question] = (vector, answer, sources)
+            while len(chat_entries) > self.max_entries_per_chat:
+                chat_entries.popitem(last=False)
+
+    def invalidate(self, chat_id):
+        """Drops a chat's cached answers and bumps its index version. Called whenever documents are indexed into it."""
+        with self.lock:
+            self.versions[chat_id] = self.versions.get(chat_id, 0) + 1
+            if self.entries.pop(chat_id, None):
+                self.invalidations += 1
+
+    def rename_chat(self, old_chat_id, new_chat_id):
+        """Moves a chat's cached answers to its new ID."""
+        with self.lock:
+            if old_chat_id in self.entries:
+                self.entries[new_chat_id] = self.entries.pop(old_chat_id)
+            version = self.versions.get(old_chat_id, 0) + 1 # Also rejects answers still being generated under the old ID.
+            self.versions[old_chat_id] = version
+            self.versions[new_chat_id] = version
+
+    def clear(self):
+        """Drops every cached answer and invalidates in-flight generations."""
+        with self.lock:
+            self.entries.clear()
+            for chat_id in self.versions:
+                self.versions[chat_id] += 1
+
+    def stats(self):
+        """Returns hit/miss counters and the number of cached answers."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "chats": len(self.entries),
+                "entries": sum(len(chat_entries) for chat_entries in self.entries.values()),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+answer_cache = SemanticAnswerCache(embeddings) # Process-wide answer cache shared by the chat endpoint and ingestion jobs.
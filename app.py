@@ -1,11 +1,23 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 from flask_cors import CORS
 from langchain_ollama.llms import OllamaLLM
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage
-from vector import get_retriever, get_vector_store
+from vector import get_retriever, get_vector_store, get_chat_settings, uses_lexical_fast_path, embeddings, check_embedding_model, clear_embedding_caches, embedding_cache_stats, forget_chroma_systems, list_chat_sources, delete_books, migrate_legacy_chats, build_missing_lexical_indexes
+from ingest import submit_ingest_job, submit_reindex_job, has_active_jobs, chat_has_active_job, get_ingest_job_status, resume_interrupted_ingests
+from tokens import estimate_tokens
+from session_cache import sessions
+from document_store import DOCUMENT_STORE_DIR, registry as document_registry
+from lexical_index import lexical_indexes
+from answer_cache import answer_cache
+from context_builder import assemble_context
+from summarize import submit_summary_job, has_active_summary_jobs, chat_has_active_summary_job, get_summary_job_status
+from metrics import registry, span, record_span, chat_request_seconds
+from single_flight import SingleFlight
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import uuid
+import time
 import shutil
 import re
 import json
@@ -15,9 +27,12 @@ app = Flask(__name__)
 CORS(app)
 
 CHAT_HISTORY_DIR = "./chat_histories" # Base directory for storing chat history files
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 1500)) # Maximum tokens of recent conversation included in a prompt.
+HISTORY_SUMMARY_ENABLED = os.environ.get("HISTORY_SUMMARY_ENABLED", "0") == "1" # Summarizes turns that fall out of the history window.
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", 100)) # Questions accepted by one /chat_batch request.
+BATCH_MAX_CONCURRENT_GENERATIONS = int(os.environ.get("BATCH_MAX_CONCURRENT_GENERATIONS", 4)) # Generations all batch requests may run at once.
+BATCH_RETRIEVAL_WORKERS = 8 # Threads running the retrievals of one batch together.
 
-chat_histories = {} # Stores in-memory chat history for active sessions.
-retrievers = {} # Stores in-memory retriever instances for active sessions.
 
 model = OllamaLLM(model="llama3.2") # Initializes the LLM model.
 
@@ -42,15 +57,23 @@ Unless a specific word count is mentioned in the question, aim for an answer len
 
 prompt = ChatPromptTemplate.from_template(template) # Creates a chat prompt template from the defined template string.
 
-def format_docs_with_sources(docs):
-    """Formats retrieved documents to include source file and chunk information."""
-    output = []
-    for doc in docs:
-        source = doc.metadata.get("source_file", "unknown.pdf")
-        chunk = doc.metadata.get("chunk", "n/a")
-        content = doc.page_content.strip()
-        output.append(f"[Source: {source}, Chunk: {chunk}]\n{content}")
-    return "\n\n".join(output)
+summary_template = """
+Condense the conversation below into a brief summary.
+Keep the questions that were asked, the key facts given in the answers, and any names, numbers or document references.
+
+Existing summary of the conversation so far:
+{summary}
+
+New conversation turns to add to the summary:
+{new_turns}
+
+Updated summary:
+"""
+
+summary_prompt = ChatPromptTemplate.from_template(summary_template) # Prompt used to fold older turns into the running summary.
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary") # Serializes summary updates off the request thread.
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENT_GENERATIONS, thread_name_prefix="batch-generate") # Bounds batch generations.
+chat_flights = SingleFlight() # Merges identical questions to the same chat while one of them is being answered.
 
 def format_chat_history(history):
     """Formats a list of chat messages into a string for the LLM prompt."""
@@ -62,6 +85,42 @@ def format_chat_history(history):
             formatted_history.append(f"AI: {message.content}")
     return "\n".join(formatted_history)
 
+def select_history_window(history, token_budget=HISTORY_TOKEN_BUDGET):
+    """Returns the index of the oldest message in the most recent run of messages that fits the token budget."""
+    used = 0
+    start = len(history)
+    while start > 0:
+        cost = estimate_tokens(history[start - 1].content) + 2 # Allows for the "Human: "/"AI: " prefix and newline.
+        if used + cost > token_budget:
+            break
+        used += cost
+        start -= 1
+    return start
+
+def build_prompt_history(chat_id, history):
+    """Formats the recent history window for the prompt, prefixed by the summary of older turns when enabled."""
+    start = select_history_window(history)
+    formatted_history = format_chat_history(history[start:])
+    if HISTORY_SUMMARY_ENABLED and start > 0:
+        summary = load_chat_summary(chat_id)["summary"]
+        if summary:
+            formatted_history = f"Summary of the earlier conversation: {summary}\n{formatted_history}"
+    return formatted_history
+
+def format_sse(event, data):
+    """Formats a payload as a single Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_stream(data):
+    """Checks whether the client asked for a streamed (SSE) chat response."""
+    if data.get("stream"):
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+def wants_timings(data):
+    """Checks whether the client asked for a per-stage timing breakdown in the chat response."""
+    return data.get("timings") is True or request.args.get("timings") == "1"
+
 def is_valid_chat_name(name):
     """Checks if a given name is valid for use as a chat ID and file system folder/file name."""
     if not name or not isinstance(name, str):
@@ -81,14 +140,25 @@ def get_chat_history_filepath(chat_id):
     os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
     return os.path.join(CHAT_HISTORY_DIR, f"{chat_id}.jsonl")
 
+def get_session_history(chat_id):
+    """Returns the chat's in-memory history from the session cache, loading it from disk on a miss. Returns None for unknown chats."""
+    if chat_id not in sessions.histories and not (os.path.exists(f"./chroma_db/{chat_id}") or os.path.exists(get_chat_history_filepath(chat_id))):
+        return None
+    return sessions.histories.get_or_create(chat_id, lambda: load_chat_history_from_file(chat_id))
+
+def get_chat_summary_filepath(chat_id):
+    """Returns the file path for a chat's running summary of older turns."""
+    os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
+    return os.path.join(CHAT_HISTORY_DIR, f"{chat_id}.summary.json")
+
 def load_chat_history_from_file(chat_id):
-    """Loads chat history from a JSONL file for a given chat ID."""
+    """Loads chat history from a JSONL file for a given chat ID, skipping any torn trailing line."""
     filepath = get_chat_history_filepath(chat_id)
     history = []
     if os.path.exists(filepath):
         try:
             with jsonlines.open(filepath, 'r') as reader:
-                for obj in reader:
+                for obj in reader.iter(type=dict, skip_invalid=True):
                     if obj['type'] == 'human':
                         history.append(HumanMessage(content=obj['content']))
                     elif obj['type'] == 'ai':
@@ -113,6 +183,162 @@ def save_chat_history_to_file(chat_id, history):
     except Exception as e:
         print(f"[{chat_id}] Error saving chat history to {filepath}: {e}")
 
+def record_chat_turn(chat_id, question, answer, timings=None):
+    """Appends a completed question/answer turn to the in-memory history and persists it."""
+    with span("persist", chat_id, timings):
+        history = sessions.histories.get_or_create(chat_id, lambda: load_chat_history_from_file(chat_id))
+        history.append(HumanMessage(content=question))
+        history.append(AIMessage(content=answer))
+        append_chat_turn_to_file(chat_id, question, answer)
+    if HISTORY_SUMMARY_ENABLED:
+        summary_executor.submit(update_chat_summary, chat_id, list(history))
+
+def lookup_cached_answer(chat_id, question, data, timings=None):
+    """Looks a question up in the chat's answer cache unless the client sent "cache": false.
+
+    Keyword-style queries skip the cache, as looking them up would embed the question the lexical fast path avoids embedding.
+    Returns (hit, question vector, cache version) as `answer_cache.lookup` does, or Nones if the cache was skipped or failed.
+    """
+    if data.get("cache", True) is False or uses_lexical_fast_path(question):
+        return None, None, None
+    try:
+        with span("answer_cache", chat_id, timings):
+            return answer_cache.lookup(chat_id, question)
+    except Exception as e:
+        print(f"[{chat_id}] Answer cache lookup failed: {e}")
+        return None, None, None
+
+def cached_answer_response(cached, timings=None):
+    """Builds the JSON body of a chat response served from the answer cache."""
+    response = {"answer": cached["answer"], "sources": cached["sources"], "cached": True, "similarity": cached["similarity"]}
+    if timings is not None:
+        response["timings"] = timings
+    return response
+
+def build_chat_prompt(chat_id, question, history, retrieved_docs, timings=None):
+    """Compacts the retrieved documents into the prompt context and formats the full prompt.
+
+    Returns (prompt value, documents used in the context, context stats).
+    """
+    with span("build_prompt", chat_id, timings) as prompt_span:
+        context, docs, context_stats = assemble_context(retrieved_docs)
+        formatted_history = build_prompt_history(chat_id, history)
+        prompt_value = prompt.invoke({"context": context, "chat_history": formatted_history, "question": question})
+        prompt_span.sizes["prompt_tokens"] = estimate_tokens(prompt_value.to_string())
+    print(f"[{chat_id}] Retrieved {len(retrieved_docs)} documents; context uses {context_stats['tokens_after']} tokens ({context_stats['tokens_saved']} saved).")
+    return prompt_value, docs, context_stats
+
+def generate_chat_answer(chat_id, question, history, retrieved_docs, timings=None):
+    """Builds the prompt from the retrieved documents and generates the answer. Returns (answer, sources, context stats)."""
+    prompt_value, docs, context_stats = build_chat_prompt(chat_id, question, history, retrieved_docs, timings)
+    with span("generate", chat_id, timings) as generate_span:
+        answer = model.invoke(prompt_value)
+        generate_span.sizes["output_tokens"] = estimate_tokens(answer)
+    return answer, [doc.metadata for doc in docs], context_stats
+
+def coalescing_key(chat_id, question):
+    """Returns the key under which identical in-flight questions to a chat are merged."""
+    return chat_id, " ".join(question.split())
+
+def format_ndjson(data):
+    """Formats one newline-delimited JSON line."""
+    return json.dumps(data) + "\n"
+
+def stream_cached_response(cached):
+    """Yields SSE events for an answer served from the answer cache, in the same shape as a live stream."""
+    yield format_sse("sources", {"sources": cached["sources"], "cached": True})
+    yield format_sse("token", {"token": cached["answer"]})
+    yield format_sse("done", {"answer": cached["answer"], "cached": True, "similarity": cached["similarity"]})
+
+def stream_chat_response(chat_id, question, chain, chain_input, docs, on_complete=None, timings=None):
+    """Yields SSE events for a chat answer: sources first, then tokens as they arrive, then a done event.
+
+    History is only recorded (and `on_complete` called with the answer and whether generation completed)
+    once generation finishes. If the client disconnects, the server closes this generator, which closes the
+    underlying LLM stream and frees the Ollama slot. The done event carries `timings` when it is given.
+    """
+    yield format_sse("sources", {"sources": [doc.metadata for doc in docs]})
+
+    tokens = []
+    completed = False
+    error = None
+    started = time.perf_counter()
+    token_stream = chain.stream(chain_input)
+    try:
+        for token in token_stream:
+            if not tokens:
+                record_span("first_token", time.perf_counter() - started, chat_id, timings)
+            tokens.append(token)
+            yield format_sse("token", {"token": token})
+        completed = True
+    except Exception as e:
+        error = e
+        print(f"[{chat_id}] Error while streaming answer: {e}")
+        yield format_sse("error", {"error": f"Failed to generate answer: {str(e)}"})
+    finally:
+        token_stream.close()
+        record_span("generate", time.perf_counter() - started, chat_id, timings, error, output_tokens=estimate_tokens("".join(tokens)))
+        if not completed:
+            print(f"[{chat_id}] Stream ended before completion. History not updated.")
+            if on_complete:
+                on_complete(None, completed=False)
+
+    if not completed:
+        return
+
+    answer = "".join(tokens)
+    record_chat_turn(chat_id, question, answer, timings)
+    if on_complete:
+        on_complete(answer)
+    print(f"[{chat_id}] Streamed answer completed and history updated.")
+    done = {"answer": answer}
+    if timings is not None:
+        done["timings"] = timings
+    yield format_sse("done", done)
+
+def append_chat_turn_to_file(chat_id, question, answer):
+    """Appends one question/answer turn to the chat's JSONL log with a single atomic write."""
+    filepath = get_chat_history_filepath(chat_id)
+    lines = json.dumps({'type': 'human', 'content': question}) + "\n" + json.dumps({'type': 'ai', 'content': answer}) + "\n"
+    try:
+        fd = os.open(filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        print(f"[{chat_id}] Appended turn to {filepath}")
+    except Exception as e:
+        print(f"[{chat_id}] Error appending chat turn to {filepath}: {e}")
+
+def load_chat_summary(chat_id):
+    """Loads a chat's running summary and the number of messages it covers."""
+    filepath = get_chat_summary_filepath(chat_id)
+    if os.path.exists(filepath):
+        try:
+            with open(filepath, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[{chat_id}] Error loading chat summary from {filepath}: {e}")
+    return {"summary": "", "covered_messages": 0}
+
+def update_chat_summary(chat_id, history):
+    """Folds messages that have dropped out of the history window into the chat's running summary."""
+    start = select_history_window(history)
+    state = load_chat_summary(chat_id)
+    if start <= state["covered_messages"]:
+        return
+    try:
+        new_turns = format_chat_history(history[state["covered_messages"]:start])
+        summary = (summary_prompt | model).invoke({"summary": state["summary"] or "(none)", "new_turns": new_turns})
+        filepath = get_chat_summary_filepath(chat_id)
+        with open(f"{filepath}.tmp", "w") as f:
+            json.dump({"summary": summary.strip(), "covered_messages": start}, f)
+        os.replace(f"{filepath}.tmp", filepath)
+        print(f"[{chat_id}] Chat summary updated to cover {start} messages.")
+    except Exception as e:
+        print(f"[{chat_id}] Error updating chat summary: {e}")
+
 @app.route('/')
 def index():
     """Serves the main landing page of the application."""
@@ -143,7 +369,7 @@ def create_chat():
     else:
         chat_id = str(uuid.uuid4())
 
-    chat_histories[chat_id] = []
+    sessions.histories.put(chat_id, [])
     save_chat_history_to_file(chat_id, [])
     
     try:
@@ -156,14 +382,12 @@ def create_chat():
 
 @app.route('/upload_pdfs/<chat_id>', methods=['POST'])
 def upload_pdfs(chat_id):
-    """Uploads PDF files for a given chat ID and indexes them into its vector store."""
-    if chat_id not in chat_histories:
-        db_location_for_chat = f"./chroma_db/{chat_id}"
-        if os.path.exists(db_location_for_chat) or os.path.exists(get_chat_history_filepath(chat_id)):
-            chat_histories[chat_id] = load_chat_history_from_file(chat_id)
-            print(f"[{chat_id}] Chat history re-initialized from file before PDF upload.")
-        else:
-            return jsonify({"error": "Chat ID not found. Cannot upload PDFs without an existing chat."}), 404
+    """Saves uploaded PDF files for a given chat ID and queues a background job to index them into its vector store."""
+    if get_session_history(chat_id) is None:
+        return jsonify({"error": "Chat ID not found. Cannot upload PDFs without an existing chat."}), 404
+
+    if chat_has_active_job(chat_id, kind="reindex"):
+        return jsonify({"error": "This chat is being re-indexed. Upload again once the re-index job finishes."}), 409
 
     if 'pdfs' not in request.files:
         return jsonify({"error": "No PDF files provided."}), 400
@@ -185,64 +409,312 @@ def upload_pdfs(chat_id):
         pdf_paths.append(file_path)
         print(f"[{chat_id}] Saved {filename} to {file_path}")
 
+    if not pdf_paths:
+        return jsonify({"error": "No PDF files selected."}), 400
+
     try:
-        vector_store_instance = get_vector_store(chat_id, pdf_files=pdf_paths)
-        retrievers[chat_id] = vector_store_instance.as_retriever(
-            search_type="mmr",
-            search_kwargs={"k": 8}
-        )
-        print(f"[{chat_id}] PDFs processed and retriever updated.")
-        return jsonify({"message": f"PDFs uploaded and indexed for chat {chat_id}."}), 200
+        job_id = submit_ingest_job(chat_id, pdf_paths)
+        return jsonify({
+            "message": f"PDFs uploaded for chat {chat_id}. Indexing started in the background.",
+            "job_id": job_id,
+            "status_url": f"/upload_status/{job_id}"
+        }), 202
     except Exception as e:
-        print(f"[{chat_id}] Error processing PDFs: {e}")
+        print(f"[{chat_id}] Error queuing PDFs for indexing: {e}")
         return jsonify({"error": f"Failed to process PDFs: {str(e)}"}), 500
 
+@app.route('/reindex/<chat_id>', methods=['POST'])
+def reindex_chat(chat_id):
+    """Rebuilds a chat's books with a new chunk size, chunk overlap or embedding model from the cached page texts.
+
+    Settings left out keep their current values. Runs as a background job reported by /upload_status;
+    the chat answers from its current books until the new ones are complete.
+    """
+    if get_session_history(chat_id) is None:
+        return jsonify({"error": "Chat ID not found. Cannot re-index a chat that does not exist."}), 404
+
+    data = request.get_json(silent=True) or {}
+    settings = get_chat_settings(chat_id)
+    for name in ("chunk_size", "chunk_overlap"):
+        value = data.get(name, settings[name])
+        if not isinstance(value, int) or isinstance(value, bool):
+            return jsonify({"error": f"'{name}' must be an integer."}), 400
+        settings[name] = value
+    embedding_model = data.get("embedding_model", settings["embedding_model"])
+    if not isinstance(embedding_model, str) or not embedding_model.strip():
+        return jsonify({"error": "'embedding_model' must be a non-empty string."}), 400
+    settings["embedding_model"] = embedding_model.strip()
+    if settings["chunk_size"] < 1 or not 0 <= settings["chunk_overlap"] < settings["chunk_size"]:
+        return jsonify({"error": "'chunk_size' must be positive and 'chunk_overlap' between 0 and chunk_size - 1."}), 400
+
+    if chat_has_active_job(chat_id):
+        return jsonify({"error": "This chat has an indexing job in progress. Try again once it finishes."}), 409
+    if not document_registry.chat_books(chat_id):
+        return jsonify({"error": "This chat has no indexed documents to re-index."}), 400
+    try:
+        check_embedding_model(settings["embedding_model"])
+    except Exception as e:
+        print(f"[{chat_id}] Embedding model '{settings['embedding_model']}' is not usable: {e}")
+        return jsonify({"error": f"Embedding model '{settings['embedding_model']}' is not available: {str(e)}"}), 400
+
+    try:
+        job_id = submit_reindex_job(chat_id, settings)
+        return jsonify({
+            "message": f"Re-indexing chat {chat_id} in the background.",
+            "settings": settings,
+            "job_id": job_id,
+            "status_url": f"/upload_status/{job_id}"
+        }), 202
+    except Exception as e:
+        print(f"[{chat_id}] Error queuing re-index: {e}")
+        return jsonify({"error": f"Failed to start re-index: {str(e)}"}), 500
+
+@app.route('/upload_status/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    """Reports per-file progress, throughput and errors for a background PDF indexing job."""
+    status = get_ingest_job_status(job_id)
+    if status is None:
+        return jsonify({"error": f"Upload job '{job_id}' not found."}), 404
+    return jsonify(status), 200
+
 @app.route('/chat/<chat_id>', methods=['POST'])
 def chat_with_llm(chat_id):
     """Handles chat interactions, retrieves documents, and generates LLM responses."""
-    if chat_id not in chat_histories:
-        db_location_for_chat = f"./chroma_db/{chat_id}"
-        if os.path.exists(db_location_for_chat) or os.path.exists(get_chat_history_filepath(chat_id)):
-            chat_histories[chat_id] = load_chat_history_from_file(chat_id)
-            print(f"[{chat_id}] Chat history re-initialized from file.")
-        else:
-            return jsonify({"error": "Chat ID not found. No previous session data found for this ID."}), 404
+    current_chat_history = get_session_history(chat_id)
+    if current_chat_history is None:
+        return jsonify({"error": "Chat ID not found. No previous session data found for this ID."}), 404
 
     data = request.get_json()
     question = data.get("question")
     if not question:
         return jsonify({"error": "No question provided."}), 400
 
-    current_retriever = retrievers.get(chat_id)
-    if not current_retriever:
-        try:
-            current_retriever = get_retriever(chat_id)
-            retrievers[chat_id] = current_retriever
-            print(f"[{chat_id}] Retriever loaded from disk.")
-        except Exception as e:
-            print(f"[{chat_id}] Error loading retriever: {e}")
-            return jsonify({"error": f"Failed to load documents for this chat. Error: {str(e)}"}), 500
+    try:
+        current_retriever = sessions.retrievers.get_or_create(chat_id, lambda: get_retriever(chat_id))
+    except Exception as e:
+        print(f"[{chat_id}] Error loading retriever: {e}")
+        return jsonify({"error": f"Failed to load documents for this chat. Error: {str(e)}"}), 500
 
     print(f"[{chat_id}] Question received: {question}")
+    request_started = time.perf_counter()
+    timings = {} if wants_timings(data) else None
+
+    def finish_request(outcome):
+        """Records the end-to-end request time and adds it to the timing breakdown."""
+        elapsed = time.perf_counter() - request_started
+        chat_request_seconds.observe(elapsed, outcome=outcome)
+        if timings is not None:
+            timings["total"] = round(elapsed * 1000, 2)
+
+    cached, question_vector, cache_version = lookup_cached_answer(chat_id, question, data, timings)
+
+    if cached:
+        print(f"[{chat_id}] Answer served from cache (similarity {cached['similarity']}).")
+        record_chat_turn(chat_id, question, cached["answer"], timings)
+        finish_request("cached")
+        if wants_stream(data):
+            return Response(stream_cached_response(cached), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+        return jsonify(cached_answer_response(cached, timings)), 200
+
+    if wants_stream(data):
+        with span("retrieve", chat_id, timings) as retrieve_span:
+            retrieved_docs = current_retriever.invoke(question)
+            retrieve_span.sizes["chunks"] = len(retrieved_docs)
+
+        prompt_value, docs, context_stats = build_chat_prompt(chat_id, question, current_chat_history, retrieved_docs, timings)
+        sources = [doc.metadata for doc in docs]
+
+        def complete_answer(answer, completed=True):
+            if completed and question_vector is not None:
+                answer_cache.store(chat_id, question, question_vector, answer, sources, cache_version)
+            finish_request("streamed" if completed else "incomplete")
+
+        print(f"[{chat_id}] Streaming answer.")
+        return Response(
+            stream_with_context(stream_chat_response(chat_id, question, model, prompt_value, docs, on_complete=complete_answer, timings=timings)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
-    docs = current_retriever.invoke(question)
-    context = format_docs_with_sources(docs)
-    print(f"[{chat_id}] Retrieved {len(docs)} documents.")
+    def compute_answer():
+        with span("retrieve", chat_id, timings) as retrieve_span:
+            retrieved_docs = current_retriever.invoke(question)
+            retrieve_span.sizes["chunks"] = len(retrieved_docs)
+        return generate_chat_answer(chat_id, question, current_chat_history, retrieved_docs, timings)
 
-    current_chat_history = chat_histories[chat_id]
-    formatted_history = format_chat_history(current_chat_history)
-    
-    chain = prompt | model
-    result = chain.invoke({"context": context, "chat_history": formatted_history, "question": question})
+    (result, sources, context_stats), coalesced = chat_flights.do(coalescing_key(chat_id, question), compute_answer)
 
-    chat_histories[chat_id].append(HumanMessage(content=question))
-    chat_histories[chat_id].append(AIMessage(content=result))
+    record_chat_turn(chat_id, question, result, timings)
+    if question_vector is not None and not coalesced: # The request that computed the answer caches it.
+        answer_cache.store(chat_id, question, question_vector, result, sources, cache_version)
+    finish_request("coalesced" if coalesced else "generated")
     
-    save_chat_history_to_file(chat_id, chat_histories[chat_id])
-    
-    print(f"[{chat_id}] Answer generated and history updated.")
+    print(f"[{chat_id}] Answer {'shared with an identical request in flight' if coalesced else 'generated'} and history updated.")
+
+    response = {"answer": result, "sources": sources, "cached": False, "coalesced": coalesced, "context_stats": context_stats}
+    if timings is not None:
+        response["timings"] = timings
+    return jsonify(response), 200
+
+@app.route('/chat_batch/<chat_id>', methods=['POST'])
+def chat_batch(chat_id):
+    """Answers many questions against a chat in one request, streaming one NDJSON line per answer as it completes.
+
+    All questions are embedded in a single call and retrieved together, except keyword-style queries, which
+    BM25 answers unembedded. Generations run on a bounded pool shared by all batches and are merged with
+    identical questions already in flight. Answers are added to the chat history only with
+    "record_history": true, so evaluation runs leave the chat unchanged.
+    """
+    current_chat_history = get_session_history(chat_id)
+    if current_chat_history is None:
+        return jsonify({"error": "Chat ID not found. No previous session data found for this ID."}), 404
+
+    data = request.get_json(silent=True) or {}
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions or not all(isinstance(question, str) and question.strip() for question in questions):
+        return jsonify({"error": "Provide 'questions' as a non-empty list of question strings."}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions can be sent in one batch."}), 400
+
+    try:
+        current_retriever = sessions.retrievers.get_or_create(chat_id, lambda: get_retriever(chat_id))
+    except Exception as e:
+        print(f"[{chat_id}] Error loading retriever: {e}")
+        return jsonify({"error": f"Failed to load documents for this chat. Error: {str(e)}"}), 500
 
-    return jsonify({"answer": result, "sources": [doc.metadata for doc in docs]}), 200
+    unique_questions = list(dict.fromkeys(" ".join(question.split()) for question in questions))
+    embedded_questions = [question for question in unique_questions if not uses_lexical_fast_path(question)] # Keyword queries go to BM25 unembedded.
+    chat_embeddings = current_retriever.vector_store.embeddings # Differs from the answer cache's model in chats re-indexed with another model.
+    try:
+        with span("embed_questions", chat_id, questions=len(embedded_questions)):
+            vectors = dict(zip(embedded_questions, chat_embeddings.embed_documents(embedded_questions))) if embedded_questions else {}
+    except Exception as e:
+        print(f"[{chat_id}] Error embedding batch questions: {e}")
+        return jsonify({"error": f"Failed to embed questions. Error: {str(e)}"}), 500
+
+    print(f"[{chat_id}] Batch of {len(questions)} question(s) received ({len(unique_questions)} distinct).")
+    return Response(
+        stream_with_context(stream_batch_answers(chat_id, questions, vectors, list(current_chat_history), current_retriever,
+                                                 data.get("cache", True) is not False, data.get("record_history") is True,
+                                                 chat_embeddings is embeddings)),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def stream_batch_answers(chat_id, questions, vectors, history, retriever, use_cache, record_history, cache_vectors=True):
+    """Yields an NDJSON line per question as its answer completes, then a summary line.
+
+    Cached answers are sent first. The remaining distinct questions are retrieved in parallel using
+    their precomputed embeddings and generated on the batch pool; repeats within the batch share one
+    answer. Closing the stream cancels generations that have not started yet. The answer cache reuses
+    the precomputed embeddings only if `cache_vectors`, i.e. they come from its own model, and is skipped
+    for keyword-style queries, which have none.
+    """
+    started = time.perf_counter()
+    counts = {"cached": 0, "generated": 0, "coalesced": 0, "failed": 0}
+    indexes_by_question = {}
+    for index, question in enumerate(questions):
+        indexes_by_question.setdefault(" ".join(question.split()), []).append(index)
+
+    def emit(question, indexes, result, counted_as):
+        """Yields the result line of every position a question was asked at."""
+        for position, index in enumerate(indexes):
+            counts[counted_as if position == 0 else "coalesced"] += 1
+            if record_history and "answer" in result:
+                record_chat_turn(chat_id, questions[index], result["answer"])
+            line = {"index": index, "question": questions[index], **result}
+            if position and "answer" in result and not result.get("cached"):
+                line["coalesced"] = True # A repeat within the batch shares the first occurrence's answer.
+            yield format_ndjson(line)
+
+    pending = []
+    for question, indexes in indexes_by_question.items():
+        cached, question_vector, cache_version = None, None, None
+        if use_cache and question in vectors:
+            try:
+                with span("answer_cache", chat_id):
+                    cached, question_vector, cache_version = answer_cache.lookup(chat_id, question, vectors[question] if cache_vectors else None)
+            except Exception as e:
+                print(f"[{chat_id}] Answer cache lookup failed: {e}")
+        if cached:
+            yield from emit(question, indexes, cached_answer_response(cached), "cached")
+        else:
+            pending.append((question, indexes, question_vector, cache_version))
+
+    def retrieve(question):
+        with span("retrieve", chat_id) as retrieve_span:
+            docs = retriever.retrieve(question, vectors.get(question))
+            retrieve_span.sizes["chunks"] = len(docs)
+        return docs
+
+    def answer(question, retrieved_docs):
+        return chat_flights.do(coalescing_key(chat_id, question), lambda: generate_chat_answer(chat_id, question, history, retrieved_docs))
+
+    with ThreadPoolExecutor(max_workers=BATCH_RETRIEVAL_WORKERS, thread_name_prefix="batch-retrieve") as retrieval_pool:
+        retrievals = [retrieval_pool.submit(retrieve, question) for question, _, _, _ in pending]
+    futures = {}
+    for item, retrieval in zip(pending, retrievals):
+        if retrieval.exception() is not None:
+            yield from emit(item[0], item[1], {"error": f"Failed to retrieve documents: {retrieval.exception()}"}, "failed")
+            continue
+        futures[batch_executor.submit(answer, item[0], retrieval.result())] = item
+
+    try:
+        for future in as_completed(futures):
+            question, indexes, question_vector, cache_version = futures[future]
+            try:
+                (result, sources, context_stats), coalesced = future.result()
+            except Exception as e:
+                print(f"[{chat_id}] Error answering batch question: {e}")
+                yield from emit(question, indexes, {"error": f"Failed to generate answer: {str(e)}"}, "failed")
+                continue
+            if question_vector is not None and not coalesced:
+                answer_cache.store(chat_id, question, question_vector, result, sources, cache_version)
+            yield from emit(question, indexes, {
+                "answer": result, "sources": sources, "cached": False, "coalesced": coalesced, "context_stats": context_stats
+            }, "coalesced" if coalesced else "generated")
+    finally:
+        for future in futures: # Frees the shared pool from a disconnected client's remaining questions.
+            future.cancel()
+
+    elapsed = time.perf_counter() - started
+    print(f"[{chat_id}] Batch of {len(questions)} question(s) answered in {elapsed:.2f}s: {counts}.")
+    yield format_ndjson({"done": True, "questions": len(questions), **counts, "seconds": round(elapsed, 3)})
+
+@app.route('/summarize/<chat_id>', methods=['POST'])
+def summarize_chat(chat_id):
+    """Starts a background map-reduce summary of one document, or of every document, in a chat."""
+    if get_session_history(chat_id) is None:
+        return jsonify({"error": "Chat ID not found. No previous session data found for this ID."}), 404
+
+    data = request.get_json(silent=True) or {}
+    source_file = data.get("source_file")
+    try:
+        sources = list_chat_sources(chat_id)
+    except Exception as e:
+        print(f"[{chat_id}] Error listing documents: {e}")
+        return jsonify({"error": f"Failed to load documents for this chat. Error: {str(e)}"}), 500
+
+    if not sources:
+        return jsonify({"error": "No documents have been indexed for this chat yet."}), 400
+    if source_file and source_file not in sources:
+        return jsonify({"error": f"Document '{source_file}' is not indexed in this chat."}), 404
+
+    os.makedirs(f"./chroma_db/{chat_id}", exist_ok=True) # Holds the summary cache; the job stops writing if it disappears.
+    job_id = submit_summary_job(chat_id, model, [source_file] if source_file else sources)
+    return jsonify({
+        "message": f"Summarizing {source_file or f'{len(sources)} document(s)'} in the background.",
+        "job_id": job_id,
+        "status_url": f"/summarize_status/{job_id}"
+    }), 202
+
+@app.route('/summarize_status/<job_id>', methods=['GET'])
+def summarize_status(job_id):
+    """Reports the progress of a summary job and the summaries of the documents it has finished."""
+    status = get_summary_job_status(job_id)
+    if status is None:
+        return jsonify({"error": f"Summary job '{job_id}' not found."}), 404
+    return jsonify(status), 200
 
 @app.route('/rename_chat', methods=['POST'])
 def rename_chat():
@@ -264,7 +736,7 @@ def rename_chat():
     old_uploaded_path = f"./uploaded_pdfs/{old_chat_id}"
     old_history_path = get_chat_history_filepath(old_chat_id)
 
-    if not (os.path.exists(old_chroma_path) or os.path.exists(old_history_path) or old_chat_id in chat_histories):
+    if not (os.path.exists(old_chroma_path) or os.path.exists(old_history_path) or old_chat_id in sessions.histories):
         return jsonify({"error": f"Original chat ID '{old_chat_id}' not found. Cannot rename."}), 404
 
     new_chroma_path = f"./chroma_db/{new_chat_name}"
@@ -274,16 +746,27 @@ def rename_chat():
     if os.path.exists(new_chroma_path) or \
        os.path.exists(new_uploaded_path) or \
        os.path.exists(new_history_path) or \
-       new_chat_name in chat_histories:
+       new_chat_name in sessions.histories:
         return jsonify({"error": f"New chat name '{new_chat_name}' already exists. Please choose a different name."}), 409
 
+    if chat_has_active_job(old_chat_id):
+        return jsonify({"error": "This chat has an indexing job in progress. Rename it once the job finishes."}), 409
+    if chat_has_active_summary_job(old_chat_id):
+        return jsonify({"error": "This chat has a summary job in progress. Rename it once the job finishes."}), 409
+
     try:
+        sessions.rename_chat(old_chat_id, new_chat_name, old_chroma_path) # Releases the old directory's client before it moves.
+        answer_cache.rename_chat(old_chat_id, new_chat_name)
+        forget_chroma_systems()
+        print(f"Updated session cache: '{old_chat_id}' -> '{new_chat_name}'")
+
         if os.path.exists(old_chroma_path):
             os.rename(old_chroma_path, new_chroma_path)
             print(f"Renamed Chroma DB from '{old_chat_id}' to '{new_chat_name}'")
         else:
             os.makedirs(new_chroma_path)
             print(f"Chroma DB for '{old_chat_id}' not found, created empty one for '{new_chat_name}'")
+        document_registry.rename_chat(old_chat_id, new_chat_name) # The chat's books stay in the shared store.
 
         if os.path.exists(old_uploaded_path):
             os.rename(old_uploaded_path, new_uploaded_path)
@@ -299,30 +782,69 @@ def rename_chat():
             save_chat_history_to_file(new_chat_name, [])
             print(f"Chat history file for '{old_chat_id}' not found, created empty one for '{new_chat_name}'")
 
-        if old_chat_id in chat_histories:
-            chat_histories[new_chat_name] = chat_histories.pop(old_chat_id)
-            print(f"Updated chat_histories: '{old_chat_id}' -> '{new_chat_name}'")
-        
-        if old_chat_id in retrievers:
-            retrievers[new_chat_name] = retrievers.pop(old_chat_id)
-            print(f"Updated retrievers: '{old_chat_id}' -> '{new_chat_name}'")
-        
+        if os.path.exists(get_chat_summary_filepath(old_chat_id)):
+            os.rename(get_chat_summary_filepath(old_chat_id), get_chat_summary_filepath(new_chat_name))
+
         print(f"Chat '{old_chat_id}' successfully renamed to '{new_chat_name}'.")
         return jsonify({"message": "Chat renamed successfully.", "new_chat_id": new_chat_name}), 200
 
     except Exception as e:
         print(f"Error renaming chat '{old_chat_id}' to '{new_chat_name}': {e}")
+        sessions.rename_chat(new_chat_name, old_chat_id, new_chroma_path)
+        document_registry.rename_chat(new_chat_name, old_chat_id)
         if os.path.exists(new_chroma_path) and not os.path.exists(old_chroma_path): os.rename(new_chroma_path, old_chroma_path)
         if os.path.exists(new_uploaded_path) and not os.path.exists(old_uploaded_path): os.rename(new_uploaded_path, old_uploaded_path)
         if os.path.exists(new_history_path) and not os.path.exists(old_history_path): os.rename(new_history_path, old_history_path)
         return jsonify({"error": f"Failed to rename chat: {str(e)}"}), 500
 
+@app.route('/delete_chat/<chat_id>', methods=['DELETE'])
+def delete_chat(chat_id):
+    """Deletes a chat's history, uploads and summaries, and removes books no other chat references from the document store."""
+    chroma_path = f"./chroma_db/{chat_id}"
+    uploaded_path = f"./uploaded_pdfs/{chat_id}"
+    history_path = get_chat_history_filepath(chat_id)
+
+    if not (os.path.exists(chroma_path) or os.path.exists(history_path) or chat_id in sessions.histories):
+        return jsonify({"error": f"Chat ID '{chat_id}' not found. Cannot delete."}), 404
+
+    if chat_has_active_job(chat_id):
+        return jsonify({"error": "This chat has an indexing job in progress. Delete it once the job finishes."}), 409
+    if chat_has_active_summary_job(chat_id):
+        return jsonify({"error": "This chat has a summary job in progress. Delete it once the job finishes."}), 409
+
+    try:
+        sessions.histories.pop(chat_id)
+        sessions.retrievers.pop(chat_id)
+        answer_cache.invalidate(chat_id)
+        orphans = document_registry.remove_chat(chat_id)
+        delete_books(orphans)
+
+        for path in (chroma_path, uploaded_path):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        for path in (history_path, get_chat_summary_filepath(chat_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+        print(f"Chat '{chat_id}' deleted ({len(orphans)} unreferenced book(s) removed from the document store).")
+        return jsonify({"message": "Chat deleted successfully.", "books_removed": len(orphans)}), 200
+    except Exception as e:
+        print(f"Error deleting chat '{chat_id}': {e}")
+        return jsonify({"error": f"Failed to delete chat: {str(e)}"}), 500
+
 @app.route('/clear_all_data', methods=['POST'])
 def clear_all_data():
-    """Clears all chat histories, uploaded files, and Chroma DBs from disk and memory."""
-    global chat_histories, retrievers
-    chat_histories = {}
-    retrievers = {}
+    """Clears all chat histories, uploaded files, Chroma DBs and cached embeddings from disk and memory."""
+    if has_active_jobs() or has_active_summary_jobs():
+        return jsonify({"error": "Indexing or summary jobs are in progress. Clear all data once they finish."}), 409
+
+    sessions.clear()
+    answer_cache.clear()
+    document_registry.clear()
+    lexical_indexes.clear()
+    forget_chroma_systems()
+
+    clear_embedding_caches()
 
     chroma_db_dir = "./chroma_db"
     uploaded_pdfs_dir = "./uploaded_pdfs"
@@ -332,6 +854,9 @@ def clear_all_data():
         if os.path.exists(chroma_db_dir):
             shutil.rmtree(chroma_db_dir)
             print(f"Deleted directory: {chroma_db_dir}")
+        if os.path.exists(DOCUMENT_STORE_DIR):
+            shutil.rmtree(DOCUMENT_STORE_DIR)
+            print(f"Deleted directory: {DOCUMENT_STORE_DIR}")
         if os.path.exists(uploaded_pdfs_dir):
             shutil.rmtree(uploaded_pdfs_dir)
             print(f"Deleted directory: {uploaded_pdfs_dir}")
@@ -348,6 +873,22 @@ def clear_all_data():
         print(f"Error clearing data: {e}")
         return jsonify({"error": f"Failed to clear data: {str(e)}"}), 500
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Reports hit/miss counters and sizes for the server's caches."""
+    return jsonify({
+        "embedding_cache": embedding_cache_stats(),
+        "sessions": sessions.stats(),
+        "answer_cache": answer_cache.stats(),
+        "document_store": document_registry.stats(),
+        "request_coalescing": chat_flights.stats()
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Exposes stage latency histograms and counters in the Prometheus text format."""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/list_chats', methods=['GET'])
 def list_chats():
     """Lists all available chat IDs by scanning the Chroma DB directories."""
@@ -373,9 +914,17 @@ def load_chat_history_api(chat_id):
     
     return jsonify({"chat_history": serializable_history}), 200
 
-if __name__ == '__main__':
+def ensure_data_directories():
+    """Creates the directories that hold vector stores, uploaded PDFs and chat histories."""
     os.makedirs("./chroma_db", exist_ok=True)
     os.makedirs("./uploaded_pdfs", exist_ok=True)
     os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
+
+if __name__ == '__main__':
+    ensure_data_directories()
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true": # Only the reloader's serving process migrates and resumes indexing.
+        migrate_legacy_chats()
+        build_missing_lexical_indexes()
+        resume_interrupted_ingests()
     print("Starting Flask application...")
     app.run(debug=True)
\ No newline at end of file
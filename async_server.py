@@ -0,0 +1,327 @@
+from app import (app, model, get_session_history, record_chat_turn, lookup_cached_answer, cached_answer_response,
+                 build_chat_prompt, stream_cached_response, format_sse, ensure_data_directories, coalescing_key)
+from vector import get_retriever, migrate_legacy_chats, build_missing_lexical_indexes
+from ingest import resume_interrupted_ingests
+from session_cache import sessions
+from answer_cache import answer_cache
+from tokens import estimate_tokens
+from metrics import span, record_span, chat_request_seconds
+from single_flight import AsyncSingleFlight
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from collections import deque
+from urllib.parse import parse_qs, unquote
+import os
+import re
+import json
+import time
+import asyncio
+import contextlib
+import uvicorn
+
+ASYNC_MAX_CONCURRENT_GENERATIONS = int(os.environ.get("ASYNC_MAX_CONCURRENT_GENERATIONS", 4)) # LLM generations allowed to run at once.
+ASYNC_WSGI_WORKERS = int(os.environ.get("ASYNC_WSGI_WORKERS", 16)) # Threads serving the other Flask routes.
+CHAT_PATH = re.compile(r"^/chat/([^/]+)$")
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")] # Matches the Flask app's CORS(app) defaults for the routes served here.
+
+class FairGenerationScheduler:
+    """Caps concurrent LLM generations and hands free slots to waiting chats in round-robin order.
+
+    Every chat has its own FIFO queue, so a chat that sends many questions at once cannot starve the
+    others: a freed slot goes to the next chat in rotation rather than to the oldest request overall.
+    All methods run on the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, max_concurrent=ASYNC_MAX_CONCURRENT_GENERATIONS):
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.waiting = {} # Maps chat ID -> deque of futures of queued requests.
+        self.rotation = deque() # Chat IDs with queued requests, in the order they will be served.
+        self.queued_total = 0
+
+    async def acquire(self, chat_id):
+        """Waits for a generation slot. A slot is taken immediately only if no other chat is queued."""
+        if self.active < self.max_concurrent and not self.rotation:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        if chat_id not in self.waiting:
+            self.waiting[chat_id] = deque()
+            self.rotation.append(chat_id)
+        self.waiting[chat_id].append(future)
+        self.queued_total += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # The slot was handed over just as the request was cancelled.
+                self.release()
+            else:
+                self.remove_waiter(chat_id, future)
+            raise
+
+    def remove_waiter(self, chat_id, future):
+        """Drops a cancelled request from its chat's queue."""
+        chat_queue = self.waiting.get(chat_id)
+        if chat_queue is None:
+            return
+        if future in chat_queue:
+            chat_queue.remove(future)
+        if not chat_queue:
+            del self.waiting[chat_id]
+            self.rotation.remove(chat_id)
+
+    def release(self):
+        """Passes the freed slot to the first request of the next chat in rotation, or returns it to the pool."""
+        while self.rotation:
+            chat_id = self.rotation.popleft()
+            chat_queue = self.waiting[chat_id]
+            future = chat_queue.popleft()
+            if chat_queue:
+                self.rotation.append(chat_id)
+            else:
+                del self.waiting[chat_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, chat_id):
+        """Holds a generation slot for the duration of the block."""
+        await self.acquire(chat_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """Returns the number of running and queued generations."""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "queued": sum(len(chat_queue) for chat_queue in self.waiting.values()),
+            "queued_chats": len(self.waiting),
+            "queued_total": self.queued_total,
+        }
+
+scheduler = FairGenerationScheduler()
+chat_flights = AsyncSingleFlight() # Merges identical non-streamed questions to the same chat while one of them is being answered.
+flask_application = WSGIMiddleware(app, workers=ASYNC_WSGI_WORKERS) # Serves every route except /chat from a thread pool.
+
+async def read_body(receive):
+    """Reads the full request body, or returns None if the client disconnects first."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+async def send_json(send, payload, status=200):
+    """Sends a complete JSON response."""
+    body = json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": CORS_HEADERS + [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+async def start_event_stream(send):
+    """Starts a Server-Sent Events response."""
+    await send({"type": "http.response.start", "status": 200, "headers": CORS_HEADERS + [
+        (b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]})
+
+async def send_event(send, event, data):
+    """Sends one Server-Sent Events message of a started event stream."""
+    await send({"type": "http.response.body", "body": format_sse(event, data).encode("utf-8"), "more_body": True})
+
+async def run_until_disconnect(receive, coroutine):
+    """Runs a request handler, cancelling it if the client disconnects first.
+
+    Cancelling the handler closes any LLM stream it holds and gives up its place in the generation queue.
+    """
+    handler = asyncio.ensure_future(coroutine)
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not handler.done():
+            handler.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await handler
+    if not handler.cancelled():
+        handler.result()
+
+async def chat(scope, receive, send, chat_id):
+    """Async version of the /chat route: retrieval and generation never block a server thread.
+
+    Accepts the same body and returns the same JSON or Server-Sent Events as the Flask route.
+    Generations wait for a slot from the fair scheduler; cheap steps run in worker threads.
+    """
+    body = await read_body(receive)
+    if body is None:
+        return
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return await send_json(send, {"error": "Request body must be JSON."}, 400)
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    stream = bool(data.get("stream")) or "text/event-stream" in headers.get("accept", "")
+    timings = {} if data.get("timings") is True or query.get("timings") == ["1"] else None
+    await run_until_disconnect(receive, answer_question(send, chat_id, data, stream, timings))
+
+async def answer_question(send, chat_id, data, stream, timings):
+    """Answers one chat question and sends the response."""
+    current_chat_history = await asyncio.to_thread(get_session_history, chat_id)
+    if current_chat_history is None:
+        return await send_json(send, {"error": "Chat ID not found. No previous session data found for this ID."}, 404)
+
+    question = data.get("question")
+    if not question:
+        return await send_json(send, {"error": "No question provided."}, 400)
+
+    try:
+        current_retriever = await asyncio.to_thread(sessions.retrievers.get_or_create, chat_id, lambda: get_retriever(chat_id))
+    except Exception as e:
+        print(f"[{chat_id}] Error loading retriever: {e}")
+        return await send_json(send, {"error": f"Failed to load documents for this chat. Error: {str(e)}"}, 500)
+
+    print(f"[{chat_id}] Question received: {question}")
+    request_started = time.perf_counter()
+    outcome = "incomplete"
+    stream_started = False
+    try:
+        cached, question_vector, cache_version = await asyncio.to_thread(lookup_cached_answer, chat_id, question, data, timings)
+        if cached:
+            print(f"[{chat_id}] Answer served from cache (similarity {cached['similarity']}).")
+            await asyncio.to_thread(record_chat_turn, chat_id, question, cached["answer"], timings)
+            outcome = "cached"
+            record_request_time(request_started, timings, outcome)
+            if not stream:
+                return await send_json(send, cached_answer_response(cached, timings))
+            await start_event_stream(send)
+            stream_started = True
+            for event in stream_cached_response(cached):
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+            return await send({"type": "http.response.body", "body": b""})
+
+        async def compute_answer():
+            nonlocal stream_started
+            with span("retrieve", chat_id, timings) as retrieve_span:
+                retrieved_docs = await current_retriever.ainvoke(question)
+                retrieve_span.sizes["chunks"] = len(retrieved_docs)
+            prompt_value, docs, context_stats = await asyncio.to_thread(build_chat_prompt, chat_id, question, current_chat_history, retrieved_docs, timings)
+            sources = [doc.metadata for doc in docs]
+
+            if stream:
+                await start_event_stream(send)
+                stream_started = True
+                await send_event(send, "sources", {"sources": sources})
+
+            queued = time.perf_counter()
+            async with scheduler.slot(chat_id):
+                record_span("queue_wait", time.perf_counter() - queued, chat_id, timings)
+                answer = await generate_answer(send, chat_id, prompt_value, stream, timings)
+            return answer, sources, context_stats
+
+        if stream: # A stream's tokens go to one client, so only plain JSON answers are shared between identical requests.
+            answer, sources, context_stats = await compute_answer()
+            coalesced = False
+        else:
+            (answer, sources, context_stats), coalesced = await chat_flights.do(coalescing_key(chat_id, question), compute_answer)
+
+        await asyncio.to_thread(record_chat_turn, chat_id, question, answer, timings)
+        if question_vector is not None and not coalesced: # The request that computed the answer caches it.
+            answer_cache.store(chat_id, question, question_vector, answer, sources, cache_version)
+        outcome = "streamed" if stream else "coalesced" if coalesced else "generated"
+        record_request_time(request_started, timings, outcome)
+        print(f"[{chat_id}] Answer {'shared with an identical request in flight' if coalesced else 'generated'} and history updated.")
+
+        if not stream:
+            response = {"answer": answer, "sources": sources, "cached": False, "coalesced": coalesced, "context_stats": context_stats}
+            if timings is not None:
+                response["timings"] = timings
+            return await send_json(send, response)
+        done = {"answer": answer}
+        if timings is not None:
+            done["timings"] = timings
+        await send_event(send, "done", done)
+        await send({"type": "http.response.body", "body": b""})
+    except asyncio.CancelledError:
+        print(f"[{chat_id}] Client disconnected before the answer completed. History not updated.")
+        raise
+    except Exception as e:
+        outcome = "failed"
+        record_request_time(request_started, timings, outcome)
+        print(f"[{chat_id}] Error while answering: {e}")
+        if not stream_started:
+            return await send_json(send, {"error": f"Failed to generate answer: {str(e)}"}, 500)
+        await send_event(send, "error", {"error": f"Failed to generate answer: {str(e)}"})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if outcome == "incomplete":
+            record_request_time(request_started, timings, outcome)
+
+async def generate_answer(send, chat_id, prompt_value, stream, timings):
+    """Generates the answer with the async LLM client, sending each token as an SSE event when streaming."""
+    tokens = []
+    started = time.perf_counter()
+    error = None
+    token_stream = model.astream(prompt_value)
+    try:
+        async for token in token_stream:
+            if not tokens:
+                record_span("first_token", time.perf_counter() - started, chat_id, timings)
+            tokens.append(token)
+            if stream:
+                await send_event(send, "token", {"token": token})
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        await token_stream.aclose() # Closes the Ollama connection if the client went away mid-stream.
+        record_span("generate", time.perf_counter() - started, chat_id, timings, error, output_tokens=estimate_tokens("".join(tokens)))
+    return "".join(tokens)
+
+def record_request_time(request_started, timings, outcome):
+    """Records the end-to-end request time and adds it to the timing breakdown."""
+    elapsed = time.perf_counter() - request_started
+    chat_request_seconds.observe(elapsed, outcome=outcome)
+    if timings is not None:
+        timings["total"] = round(elapsed * 1000, 2)
+
+async def lifespan(receive, send):
+    """Prepares the data directories and resumes interrupted indexing when the server starts."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            ensure_data_directories()
+            await asyncio.to_thread(migrate_legacy_chats)
+            await asyncio.to_thread(build_missing_lexical_indexes)
+            await asyncio.to_thread(resume_interrupted_ingests)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    """ASGI entry point: /chat and /generation_stats are served natively, everything else by the Flask app."""
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    match = CHAT_PATH.match(scope["path"])
+    if scope["type"] == "http" and scope["method"] == "POST" and match:
+        return await chat(scope, receive, send, unquote(match.group(1)))
+    if scope["type"] == "http" and scope["method"] == "GET" and scope["path"] == "/generation_stats":
+        return await send_json(send, {**scheduler.stats(), "request_coalescing": chat_flights.stats()})
+    await flask_application(scope, receive, send)
+
+if __name__ == '__main__':
+    print("Starting async application...")
+    uvicorn.run(application, host=os.environ.get("HOST", "127.0.0.1"), port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,162 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+
+# Stand-in for the Ollama HTTP API used by the benchmarks. It serves /api/embed and /api/generate
+# with configurable latency. Embeddings are deterministic hashed bag-of-words vectors, so texts that
+# share words are similar and retrieval behaves plausibly.
+
+WORD_PATTERN = re.compile(r"\w+")
+
+class FakeOllamaConfig:
+    """Latency and output settings of the fake server."""
+
+    def __init__(self, dimensions=256, embed_latency_ms=20.0, embed_latency_per_text_ms=1.0,
+                 first_token_latency_ms=100.0, token_latency_ms=10.0, answer_tokens=60):
+        self.dimensions = dimensions
+        self.embed_latency_ms = embed_latency_ms # Fixed cost of every /api/embed request.
+        self.embed_latency_per_text_ms = embed_latency_per_text_ms # Added per text in the request.
+        self.first_token_latency_ms = first_token_latency_ms # Delay before the first generated token.
+        self.token_latency_ms = token_latency_ms # Delay between generated tokens.
+        self.answer_tokens = answer_tokens
+
+def embed_text(text, dimensions):
+    """Returns a deterministic unit vector for a text by hashing its lowercased words into signed buckets."""
+    vector = [0.0] * dimensions
+    for word in WORD_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm: # No words at all; fall back to a fixed direction.
+        vector[0] = 1.0
+        return vector
+    return [value / norm for value in vector]
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Handles the subset of the Ollama API the app calls."""
+
+    protocol_version = "HTTP/1.1"
+    config = FakeOllamaConfig()
+    counters = {"embed_requests": 0, "embedded_texts": 0, "generate_requests": 0, "generations_cancelled": 0}
+    counters_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, name, amount=1):
+        with self.counters_lock:
+            self.counters[name] += amount
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self.send_json({"models": [{"name": "llama3.2"}, {"name": "mxbai-embed-large"}]})
+        if self.path == "/api/version":
+            return self.send_json({"version": "0.0.0-bench"})
+        if self.path == "/bench/stats":
+            with self.counters_lock:
+                return self.send_json(dict(self.counters))
+        self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/embed":
+            return self.handle_embed(body)
+        if self.path == "/api/generate":
+            return self.handle_generate(body)
+        self.send_json({"error": "not found"}, status=404)
+
+    def handle_embed(self, body):
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        self.count("embed_requests")
+        self.count("embedded_texts", len(texts))
+        time.sleep((self.config.embed_latency_ms + self.config.embed_latency_per_text_ms * len(texts)) / 1000)
+        self.send_json({
+            "model": body.get("model"),
+            "embeddings": [embed_text(text, self.config.dimensions) for text in texts],
+        })
+
+    def handle_generate(self, body):
+        self.count("generate_requests")
+        model = body.get("model")
+        words = [f"token{i}" for i in range(self.config.answer_tokens)]
+        time.sleep(self.config.first_token_latency_ms / 1000)
+
+        if not body.get("stream", True):
+            time.sleep(self.config.token_latency_ms * max(0, len(words) - 1) / 1000)
+            return self.send_json({"model": model, "response": " ".join(words), "done": True})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(self.config.token_latency_ms / 1000)
+                self.write_chunk({"model": model, "response": word + " ", "done": False})
+            self.write_chunk({"model": model, "response": "", "done": True, "eval_count": len(words)})
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.count("generations_cancelled")
+            self.close_connection = True
+
+def start_fake_ollama(config, host="127.0.0.1", port=0):
+    """Starts the fake server on a background thread and returns it; `server.server_address` has the bound port."""
+    handler = type("ConfiguredFakeOllamaHandler", (FakeOllamaHandler,), {
+        "config": config,
+        "counters": dict(FakeOllamaHandler.counters),
+        "counters_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+def add_latency_arguments(parser):
+    """Adds the fake server's latency options to an argument parser."""
+    parser.add_argument("--dimensions", type=int, default=256, help="Embedding vector size.")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="Fixed latency of each embedding request.")
+    parser.add_argument("--embed-latency-per-text-ms", type=float, default=1.0, help="Extra embedding latency per text.")
+    parser.add_argument("--first-token-latency-ms", type=float, default=100.0, help="Delay before the first generated token.")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0, help="Delay between generated tokens.")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Tokens in every generated answer.")
+
+def config_from_arguments(args):
+    """Builds a FakeOllamaConfig from parsed latency options."""
+    return FakeOllamaConfig(args.dimensions, args.embed_latency_ms, args.embed_latency_per_text_ms,
+                            args.first_token_latency_ms, args.token_latency_ms, args.answer_tokens)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake Ollama API for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    server = start_fake_ollama(config_from_arguments(args), args.host, args.port)
+    print(f"Fake Ollama listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
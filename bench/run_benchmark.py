@@ -0,0 +1,365 @@
+from concurrent.futures import ThreadPoolExecutor
+from fake_ollama import add_latency_arguments
+from synthetic_pdf import make_pdf
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import requests
+
+# Offline benchmark of the app: ingest throughput, retrieval latency and /chat latency under concurrent
+# load. Ollama is replaced by bench/fake_ollama.py running in its own process, and the app runs on a
+# threaded Werkzeug server in a scratch directory, so runs never touch real chats or a real model.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BENCH_CHAT_ID = "bench"
+REPEAT_CHAT_ID = "bench-repeat" # Second chat the same books are uploaded to, timing deduplicated ingest.
+COMPARED_METRICS = [ # (section, metric, True if higher is better); nested sections are dotted.
+    ("ingest", "pages_per_second", True),
+    ("ingest", "chunks_per_second", True),
+    ("retrieval.natural_language", "p50_ms", False),
+    ("retrieval.natural_language", "p95_ms", False),
+    ("retrieval.keyword", "p50_ms", False),
+    ("retrieval.keyword", "p95_ms", False),
+    ("chat", "p50_ms", False),
+    ("chat", "p95_ms", False),
+    ("chat", "p99_ms", False),
+    ("chat", "requests_per_second", True),
+]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def summarize_latencies(seconds):
+    """Returns count, mean and percentile latencies in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    values = np.asarray(seconds) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+def start_fake_ollama_process(args, port):
+    """Starts bench/fake_ollama.py in its own process and waits until it answers."""
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "fake_ollama.py"), "--port", str(port),
+        "--dimensions", str(args.dimensions),
+        "--embed-latency-ms", str(args.embed_latency_ms),
+        "--embed-latency-per-text-ms", str(args.embed_latency_per_text_ms),
+        "--first-token-latency-ms", str(args.first_token_latency_ms),
+        "--token-latency-ms", str(args.token_latency_ms),
+        "--answer-tokens", str(args.answer_tokens),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/tags", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Fake Ollama server did not start.")
+
+def start_app_server(kind):
+    """Imports the app (after OLLAMA_HOST is set) and serves it in a background thread.
+
+    `kind` is "flask" for the threaded Werkzeug server or "async" for async_server.py on uvicorn.
+    Returns (stop function, base URL).
+    """
+    sys.path.insert(0, REPO_ROOT)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR) # One access log line per request would drown the report.
+    if kind == "async":
+        import uvicorn
+        import async_server
+
+        server = uvicorn.Server(uvicorn.Config(async_server.application, host="127.0.0.1", port=free_port(), log_level="warning"))
+        threading.Thread(target=server.run, name="bench-app", daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+        return stop, f"http://127.0.0.1:{server.config.port}"
+
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    app_module.ensure_data_directories()
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return server.shutdown, f"http://127.0.0.1:{server.port}"
+
+def upload_and_wait(base_url, chat_id, pdf_paths):
+    """Uploads PDFs to a chat and polls until the indexing job finishes. Returns (job status, wall seconds)."""
+    files = [("pdfs", (os.path.basename(path), open(path, "rb"), "application/pdf")) for path in pdf_paths]
+    started = time.perf_counter()
+    try:
+        response = requests.post(f"{base_url}/upload_pdfs/{chat_id}", files=files)
+    finally:
+        for _, (_, handle, _) in files:
+            handle.close()
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+
+    while True:
+        status = requests.get(f"{base_url}/upload_status/{job_id}").json()
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+    return status, time.perf_counter() - started
+
+def run_ingest_benchmark(base_url, args):
+    """Uploads synthetic books to the bench chat and waits for indexing, returning throughput figures.
+
+    The same books are then uploaded to a second chat, which the document store serves without indexing them again.
+    """
+    pdf_paths = []
+    for i in range(args.books):
+        path = os.path.join("bench_books", f"book_{i + 1}.pdf")
+        pdf_paths.append(make_pdf(path, args.pages, args.words_per_page, seed=args.seed + i))
+
+    status, wall_seconds = upload_and_wait(base_url, BENCH_CHAT_ID, pdf_paths)
+    requests.post(f"{base_url}/create_chat", json={"chat_name": REPEAT_CHAT_ID}).raise_for_status()
+    repeat_status, repeat_seconds = upload_and_wait(base_url, REPEAT_CHAT_ID, pdf_paths)
+
+    return {
+        "status": status["status"],
+        "books": args.books,
+        "pages": status["pages_parsed"],
+        "chunks": status["chunks_embedded"],
+        "wall_seconds": round(wall_seconds, 3),
+        "pages_per_second": round(status["pages_parsed"] / wall_seconds, 2),
+        "chunks_per_second": round(status["chunks_embedded"] / wall_seconds, 2),
+        "embedding": status["embedding"],
+        "errors": status["errors"],
+        "repeat_upload_seconds": round(repeat_seconds, 3),
+        "repeat_upload_deduplicated": sum(1 for progress in repeat_status["files"].values() if progress["deduplicated"]),
+    }
+
+BENCHMARK_TOPICS = ["the captain and the silver crown", "the storm over the harbor", "the old lighthouse keeper", "the journey across the river"]
+
+def benchmark_question(i):
+    """Returns a distinct natural-language question, so neither the embedding nor the answer cache can serve it
+    and it takes the vector (hybrid) retrieval path rather than the lexical fast path."""
+    return f"What happens to {BENCHMARK_TOPICS[i % len(BENCHMARK_TOPICS)]} after they meet again? (question {i})"
+
+def keyword_query(i):
+    """Returns a keyword-style query (a chapter reference with a name) that the lexical fast path answers."""
+    return f"captain chapter {i % 12 + 1}"
+
+def run_retrieval_benchmark(args):
+    """Times retriever calls made in-process, separately for natural-language questions, which include the
+    question embedding round trip, and for keyword queries. Each set reports the retrieval modes it took."""
+    from vector import get_retriever
+    from metrics import retrieval_queries
+
+    retriever = get_retriever(BENCH_CHAT_ID)
+    results = {}
+    for name, make_query in (("natural_language", benchmark_question), ("keyword", keyword_query)):
+        modes_before = dict(retrieval_queries.values)
+        latencies = []
+        for i in range(args.retrieval_queries):
+            started = time.perf_counter()
+            retriever.invoke(make_query(10_000 + i))
+            latencies.append(time.perf_counter() - started)
+        results[name] = summarize_latencies(latencies)
+        results[name]["modes"] = {
+            key[0]: count - modes_before.get(key, 0) for key, count in retrieval_queries.values.items() if count != modes_before.get(key, 0)
+        }
+    return results
+
+def send_chat_request(base_url, question, stream):
+    """Sends one /chat request and returns (total seconds, seconds to first token or None)."""
+    payload = {"question": question, "cache": False, "stream": stream}
+    started = time.perf_counter()
+    first_token = None
+    with requests.post(f"{base_url}/chat/{BENCH_CHAT_ID}", json=payload, stream=stream, timeout=300) as response:
+        response.raise_for_status()
+        if stream:
+            for line in response.iter_lines(decode_unicode=True):
+                if first_token is None and line == "event: token":
+                    first_token = time.perf_counter() - started
+        else:
+            response.json()
+    return time.perf_counter() - started, first_token
+
+def probe_cheap_endpoint(base_url, stop, latencies):
+    """Polls GET /list_chats until `stop` is set, to show whether cheap routes stay fast during generations."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        requests.get(f"{base_url}/list_chats", timeout=300)
+        latencies.append(time.perf_counter() - started)
+        stop.wait(0.05)
+
+def run_chat_benchmark(base_url, args):
+    """Sends /chat requests from `concurrency` threads and returns latency percentiles and throughput.
+
+    While they run, /list_chats is polled and its latency reported as `cheap_endpoint`.
+    """
+    for i in range(args.warmup):
+        send_chat_request(base_url, benchmark_question(20_000 + i), args.stream)
+
+    latencies, first_tokens, failures = [], [], []
+    lock = threading.Lock()
+
+    def worker(i):
+        try:
+            seconds, first_token = send_chat_request(base_url, benchmark_question(i), args.stream)
+        except Exception as e:
+            with lock:
+                failures.append(str(e))
+            return
+        with lock:
+            latencies.append(seconds)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    probe_latencies = []
+    stop_probe = threading.Event()
+    probe = threading.Thread(target=probe_cheap_endpoint, args=(base_url, stop_probe, probe_latencies), daemon=True)
+    started = time.perf_counter()
+    probe.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.chat_requests)))
+    wall_seconds = time.perf_counter() - started
+    stop_probe.set()
+    probe.join()
+
+    result = summarize_latencies(latencies)
+    result.update({
+        "concurrency": args.concurrency,
+        "stream": args.stream,
+        "failures": len(failures),
+        "wall_seconds": round(wall_seconds, 3),
+        "requests_per_second": round(len(latencies) / wall_seconds, 2),
+    })
+    if failures:
+        result["first_failure"] = failures[0]
+    if first_tokens:
+        result["time_to_first_token"] = summarize_latencies(first_tokens)
+    result["cheap_endpoint"] = summarize_latencies(probe_latencies)
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(baseline, current):
+    """Prints each compared metric of two result files with its relative change."""
+    ignored = {"output", "baseline", "keep_workdir"}
+    differing = sorted(key for key, value in current["config"].items()
+                       if key not in ignored and baseline.get("config", {}).get(key) != value)
+    if differing:
+        print(f"Warning: runs used different settings ({', '.join(differing)}); changes may not be comparable.")
+    print(f"{'metric':<32}{'baseline':>12}{'current':>12}{'change':>10}")
+    def lookup(results, section, metric):
+        for name in section.split("."):
+            results = results.get(name, {}) if isinstance(results, dict) else {}
+        return results.get(metric) if isinstance(results, dict) else None
+
+    for section, metric, higher_is_better in COMPARED_METRICS:
+        old = lookup(baseline, section, metric)
+        new = lookup(current, section, metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        verdict = "" if abs(change) < 5 else (" better" if (change > 0) == higher_is_better else " worse")
+        print(f"{section + '.' + metric:<32}{old:>12}{new:>12}{change:>+9.1f}%{verdict}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and /chat against a fake Ollama.")
+    parser.add_argument("--books", type=int, default=2, help="Synthetic books uploaded in the ingest benchmark.")
+    parser.add_argument("--pages", type=int, default=100, help="Pages per synthetic book.")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--retrieval-queries", type=int, default=50, help="Queries timed per query set (natural-language and keyword).")
+    parser.add_argument("--chat-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients sending /chat requests at once.")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured /chat requests sent first.")
+    parser.add_argument("--server", choices=("flask", "async"), default="flask", help="Serve the app with Werkzeug threads or async_server.py.")
+    parser.add_argument("--stream", action="store_true", help="Use streamed /chat responses and report time to first token.")
+    parser.add_argument("--output", help="Result file (default: bench/results/bench-<timestamp>.json).")
+    parser.add_argument("--baseline", help="Earlier result file to compare this run against.")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the scratch directory with the chat data.")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    started_at = datetime.datetime.now()
+    output_path = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"bench-{started_at:%Y%m%d-%H%M%S}.json"))
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix="bookanalyzer-bench-")
+    ollama_port = free_port()
+    fake_ollama = start_fake_ollama_process(args, ollama_port)
+    os.environ["OLLAMA_HOST"] = f"127.0.0.1:{ollama_port}"
+    os.chdir(workdir)
+    os.makedirs("bench_books", exist_ok=True)
+
+    stop_server = None
+    try:
+        stop_server, base_url = start_app_server(args.server)
+        requests.post(f"{base_url}/create_chat", json={"chat_name": BENCH_CHAT_ID}).raise_for_status()
+
+        print(f"Ingesting {args.books} x {args.pages} pages...")
+        ingest = run_ingest_benchmark(base_url, args)
+        print(f"Timing {args.retrieval_queries} natural-language and {args.retrieval_queries} keyword retrievals...")
+        retrieval = run_retrieval_benchmark(args)
+        print(f"Sending {args.chat_requests} /chat requests with concurrency {args.concurrency}...")
+        chat = run_chat_benchmark(base_url, args)
+
+        results = {
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+            "ingest": ingest,
+            "retrieval": retrieval,
+            "chat": chat,
+            "fake_ollama": requests.get(f"http://127.0.0.1:{ollama_port}/bench/stats").json(),
+            "cache_stats": requests.get(f"{base_url}/cache_stats").json(),
+        }
+    finally:
+        if stop_server is not None:
+            stop_server()
+        fake_ollama.terminate()
+        fake_ollama.wait()
+        os.chdir(REPO_ROOT)
+        if args.keep_workdir:
+            print(f"Scratch data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({section: results[section] for section in ("ingest", "retrieval", "chat")}, indent=2))
+    print(f"Results saved to {output_path}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import random
+
+# Writes plain-text PDFs of any page count without extra dependencies. Text is generated from a fixed
+# vocabulary with a seeded RNG, so the same arguments always produce the same book.
+
+VOCABULARY = (
+    "the river king letter winter garden soldier promise city harbor ship captain map storm island "
+    "village market teacher lesson history battle treaty council bridge forest wolf lantern road "
+    "journey silver crown secret library scholar mountain valley festival merchant debt fortune "
+    "mother brother sister friend enemy memory truth lie courage fear night morning fire water stone"
+).split()
+CHARACTERS = ["Elena", "Marcus", "Ines", "Tobias", "Amara", "Jonah", "Selim", "Hana"]
+
+def escape_pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def generate_page_lines(rng, page_number, pages_per_chapter, words_per_page, words_per_line=12):
+    """Returns the text lines of one page, starting with a chapter heading on each chapter's first page."""
+    lines = []
+    if (page_number - 1) % pages_per_chapter == 0:
+        lines.append(f"Chapter {(page_number - 1) // pages_per_chapter + 1}")
+    words = []
+    while len(words) < words_per_page:
+        sentence = [rng.choice(CHARACTERS)] + [rng.choice(VOCABULARY) for _ in range(rng.randint(6, 14))]
+        words.extend(sentence[:-1] + [sentence[-1] + "."])
+    for start in range(0, words_per_page, words_per_line):
+        lines.append(" ".join(words[start:start + words_per_line]))
+    lines.append(f"Page {page_number}")
+    return lines
+
+def make_pdf(path, pages, words_per_page=400, pages_per_chapter=10, seed=0):
+    """Writes a PDF with `pages` pages of generated prose to `path`."""
+    rng = random.Random(seed)
+    font_object = 3 + 2 * pages
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(pages))}] /Count {pages} >>",
+    ]
+    for i in range(pages):
+        lines = generate_page_lines(rng, i + 1, pages_per_chapter, words_per_page)
+        stream = "BT /F1 9 Tf 36 806 Td 11 TL " + " ".join(f"({escape_pdf_text(line)}) '" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 {font_object} 0 R >> >> /Contents {4 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    output = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n"
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as pdf_file:
+        pdf_file.write(output)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF book for benchmarks.")
+    parser.add_argument("path")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_pdf(args.path, args.pages, args.words_per_page, seed=args.seed)
+    print(f"Wrote {args.pages} pages to {args.path}")
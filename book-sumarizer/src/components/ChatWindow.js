@@ -63,7 +63,8 @@ function ChatWindow({ API_BASE_URL, chatId, onChatRenamed }) {
 
       const data = await response.json();
       if (response.ok) {
-        setUploadStatus(`Success: ${data.message}`);
+        setUploadStatus(data.message);
+        pollUploadStatus(data.job_id);
       } else {
         setUploadStatus(`Error: ${data.error || 'Unknown error'}`);
         console.error('File upload failed:', data);
@@ -74,6 +75,29 @@ function ChatWindow({ API_BASE_URL, chatId, onChatRenamed }) {
     }
   };
 
+  const pollUploadStatus = async (jobId) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/upload_status/${jobId}`);
+      const job = await response.json();
+      if (!response.ok) {
+        setUploadStatus(`Error: ${job.error || 'Unknown error'}`);
+        return;
+      }
+      if (job.status === 'queued' || job.status === 'running') {
+        setUploadStatus(`Indexing... ${job.pages_parsed} pages parsed, ${job.chunks_embedded} chunks embedded.`);
+        setTimeout(() => pollUploadStatus(jobId), 2000);
+      } else if (job.errors.length > 0) {
+        setUploadStatus(`Indexing ${job.status}: ${job.errors.map(e => `${e.file}: ${e.error}`).join('; ')}`);
+      } else {
+        const reused = job.files_deduplicated ? ` (${job.files_deduplicated} file(s) already in the document store)` : '';
+        setUploadStatus(`Success: ${job.chunks_total} chunks indexed from ${Object.keys(job.files).length} file(s)${reused}.`);
+      }
+    } catch (error) {
+      console.error('Error checking upload status:', error);
+      setUploadStatus('Error connecting to server to check indexing progress.');
+    }
+  };
+
   const handleQuestionSubmit = async (event) => {
     event.preventDefault();
     const question = questionInput.trim();
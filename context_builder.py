@@ -0,0 +1,87 @@
+from tokens import estimate_tokens
+import os
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000)) # Maximum tokens of retrieved text placed in a prompt.
+MAX_CHUNK_OVERLAP_CHARS = 600 # Longest shared prefix/suffix searched for between neighbouring chunks.
+MIN_CHUNK_OVERLAP_CHARS = 20 # Shorter matches are treated as coincidence rather than splitter overlap.
+
+def format_passage(source, chunks, content):
+    """Formats one passage of the context with its source file and chunk numbers."""
+    label = f"Chunk: {chunks[0]}" if len(chunks) == 1 else f"Chunks: {chunks[0]}-{chunks[-1]}"
+    return f"[Source: {source}, {label}]\n{content}"
+
+def overlap_length(previous, current, max_overlap=MAX_CHUNK_OVERLAP_CHARS):
+    """Returns the length of the longest suffix of `previous` that is also a prefix of `current`, or 0 if it is too short to trust."""
+    for length in range(min(len(previous), len(current), max_overlap), MIN_CHUNK_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:length]):
+            return length
+    return 0
+
+def merge_adjacent_chunks(docs):
+    """Groups retrieved chunks into passages of consecutive chunks from the same file, removing overlapping text.
+
+    Returns passages as dicts with their source, chunk numbers, merged content and best relevance rank.
+    Documents without a numeric chunk index are kept as passages of their own.
+    """
+    ranked = []
+    for rank, doc in enumerate(docs):
+        ranked.append((rank, doc.metadata.get("source_file", "unknown.pdf"), doc.metadata.get("chunk"), doc.page_content.strip()))
+
+    passages = []
+    seen = set()
+    sortable = sorted((item for item in ranked if isinstance(item[2], int)), key=lambda item: (item[1], item[2]))
+    for rank, source, chunk, content in sortable:
+        if (source, chunk) in seen: # The same chunk retrieved twice.
+            continue
+        seen.add((source, chunk))
+        last = passages[-1] if passages else None
+        if last and last["source"] == source and last["chunks"][-1] == chunk - 1:
+            shared = overlap_length(last["content"], content)
+            last["content"] += content[shared:] if shared else "\n" + content
+            last["chunks"].append(chunk)
+            last["rank"] = min(last["rank"], rank)
+        else:
+            passages.append({"source": source, "chunks": [chunk], "content": content, "rank": rank})
+
+    for rank, source, chunk, content in ranked:
+        if not isinstance(chunk, int):
+            passages.append({"source": source, "chunks": [chunk if chunk is not None else "n/a"], "content": content, "rank": rank})
+    return passages
+
+def assemble_context(docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Builds the prompt context from retrieved documents within a token budget.
+
+    Adjacent chunks are merged with their overlap removed, then passages are packed in order of
+    relevance (the retriever's ranking) until the budget is spent; passages that do not fit are skipped.
+    Returns (context string, documents used, stats dict with token counts before and after compaction).
+    """
+    tokens_before = sum(
+        estimate_tokens(format_passage(doc.metadata.get("source_file", "unknown.pdf"), [doc.metadata.get("chunk", "n/a")], doc.page_content.strip()))
+        for doc in docs
+    )
+
+    packed = []
+    tokens_used = 0
+    skipped = 0
+    for passage in sorted(merge_adjacent_chunks(docs), key=lambda passage: passage["rank"]):
+        text = format_passage(passage["source"], passage["chunks"], passage["content"])
+        cost = estimate_tokens(text)
+        if tokens_used + cost > token_budget:
+            skipped += 1
+            continue
+        packed.append((passage, text))
+        tokens_used += cost
+
+    used_chunks = {(passage["source"], chunk) for passage, _ in packed for chunk in passage["chunks"]}
+    used_docs = [doc for doc in docs if (doc.metadata.get("source_file", "unknown.pdf"), doc.metadata.get("chunk", "n/a")) in used_chunks]
+
+    stats = {
+        "chunks_retrieved": len(docs),
+        "passages": len(packed),
+        "passages_skipped": skipped,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_used,
+        "tokens_saved": tokens_before - tokens_used,
+        "token_budget": token_budget,
+    }
+    return "\n\n".join(text for _, text in packed), used_docs, stats
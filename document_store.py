@@ -0,0 +1,236 @@
+import os
+import json
+import hashlib
+import threading
+
+DOCUMENT_STORE_DIR = "./document_store" # Shared Chroma store holding every indexed book once, plus the registry below.
+REGISTRY_FILENAME = "registry.json"
+
+def file_fingerprint(file_path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_book_key(fingerprint, chunk_size, chunk_overlap, embedding_model):
+    """Returns the content address of an indexed book: its file hash plus everything that shapes its chunks and vectors."""
+    return hashlib.sha256(f"{fingerprint}:{chunk_size}:{chunk_overlap}:{embedding_model}".encode("utf-8")).hexdigest()
+
+class DocumentRegistry:
+    """Records which books the shared store holds, how far each has been indexed, and which chats reference them.
+
+    A book's reference count is the number of chats that list it, including chats re-indexing into it.
+    Chats indexed with non-default chunking or embedding settings have them recorded here too. The
+    registry is a small JSON file rewritten atomically on every change; all access goes through one lock.
+    """
+
+    def __init__(self, directory=DOCUMENT_STORE_DIR):
+        self.path = os.path.join(directory, REGISTRY_FILENAME)
+        self.lock = threading.Lock()
+        self.state = None # Loaded on first use; see empty_state for the layout.
+
+    @staticmethod
+    def empty_state():
+        return {
+            "books": {}, # Book key -> {fingerprint, embedding_model, pages_committed, chunks_committed, complete}.
+            "chats": {}, # Chat ID -> {file name: book key}.
+            "settings": {}, # Chat ID -> {chunk_size, chunk_overlap, embedding_model}, for chats that were re-indexed.
+            "staged": {}, # Chat ID -> {"settings": ..., "files": {file name: book key}} of a re-index in progress.
+        }
+
+    def load(self):
+        """Loads the registry from disk if it is not loaded yet. Must be called with the lock held."""
+        if self.state is not None:
+            return self.state
+        self.state = self.empty_state()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.state.update(json.load(f))
+            except Exception as e:
+                print(f"Error loading document registry from {self.path}: {e}")
+        return self.state
+
+    def save(self):
+        """Atomically writes the registry. Must be called with the lock held."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.path)
+
+    def get_book(self, book_key):
+        """Returns a copy of a book's entry, or None if the store has never seen it."""
+        with self.lock:
+            book = self.load()["books"].get(book_key)
+            return dict(book) if book else None
+
+    def book_keys(self):
+        """Returns the keys of every stored book."""
+        with self.lock:
+            return list(self.load()["books"])
+
+    def ensure_book(self, book_key, fields):
+        """Creates a book's entry if needed and fills in any of `fields` it lacks. Must be called with the lock held."""
+        book = self.state["books"].setdefault(book_key, {"pages_committed": 0, "chunks_committed": 0, "complete": False})
+        for name, value in fields.items():
+            book.setdefault(name, value)
+
+    def update_book(self, book_key, **fields):
+        """Updates a book's entry. Books are created by add_chat_book or stage_chat_book, so a checkpoint
+        arriving after its book was removed (e.g. by clearing all data) does not bring the book back."""
+        with self.lock:
+            book = self.load()["books"].get(book_key)
+            if book is None:
+                return
+            book.update(fields)
+            self.save()
+
+    def add_chat_book(self, chat_id, filename, book_key, **book_fields):
+        """References a book from a chat under the file name the chat uploaded it as.
+
+        `book_fields` (fingerprint, embedding_model) are recorded if the book is new. Returns the books
+        no chat references any more because the file name pointed to other content before, which are
+        removed too, as a dict of book key -> entry.
+        """
+        with self.lock:
+            state = self.load()
+            self.ensure_book(book_key, book_fields)
+            state["chats"].setdefault(chat_id, {})[filename] = book_key
+            orphans = self.remove_orphans()
+            self.save()
+            return orphans
+
+    def stage_chat_book(self, chat_id, filename, book_key, settings, **book_fields):
+        """References a book from a chat's re-index in progress, which the chat does not search until it is committed."""
+        with self.lock:
+            state = self.load()
+            self.ensure_book(book_key, book_fields)
+            staged = state["staged"].setdefault(chat_id, {"settings": settings, "files": {}})
+            staged["settings"] = settings
+            staged["files"][filename] = book_key
+            self.save()
+
+    def commit_staged(self, chat_id):
+        """Switches a chat to the books and settings of its finished re-index. Returns the books no longer referenced, as remove_chat does."""
+        with self.lock:
+            state = self.load()
+            staged = state["staged"].pop(chat_id, None)
+            if staged is None:
+                return {}
+            state["chats"][chat_id] = staged["files"]
+            state["settings"][chat_id] = staged["settings"]
+            orphans = self.remove_orphans()
+            self.save()
+            return orphans
+
+    def discard_staged(self, chat_id):
+        """Abandons a chat's re-index. Returns the books no longer referenced, as remove_chat does."""
+        with self.lock:
+            state = self.load()
+            if state["staged"].pop(chat_id, None) is None:
+                return {}
+            orphans = self.remove_orphans()
+            self.save()
+            return orphans
+
+    def staged_chats(self):
+        """Returns chat ID -> target settings for every re-index that has not been committed."""
+        with self.lock:
+            return {chat_id: dict(staged["settings"]) for chat_id, staged in self.load()["staged"].items()}
+
+    def chat_settings(self, chat_id):
+        """Returns the chunking and embedding settings a chat was re-indexed with, or None if it uses the defaults."""
+        with self.lock:
+            settings = self.load()["settings"].get(chat_id)
+            return dict(settings) if settings else None
+
+    def chat_books(self, chat_id):
+        """Returns a chat's books as a dict of book key -> file name in that chat."""
+        with self.lock:
+            return {book_key: filename for filename, book_key in self.load()["chats"].get(chat_id, {}).items()}
+
+    def book_chats(self, book_key):
+        """Returns the IDs of the chats that reference a book."""
+        with self.lock:
+            return [chat_id for chat_id, files in self.load()["chats"].items() if book_key in files.values()]
+
+    def fingerprint_in_use(self, fingerprint):
+        """Returns True if any stored book was built from the file with this SHA-256."""
+        with self.lock:
+            return any(book.get("fingerprint") == fingerprint for book in self.load()["books"].values())
+
+    def reference_counts(self):
+        """Returns the number of chat references per book. Must be called with the lock held."""
+        counts = {book_key: 0 for book_key in self.state["books"]}
+        file_maps = list(self.state["chats"].values()) + [staged["files"] for staged in self.state["staged"].values()]
+        for files in file_maps:
+            for book_key in set(files.values()):
+                counts[book_key] = counts.get(book_key, 0) + 1
+        return counts
+
+    def remove_orphans(self):
+        """Removes the books no chat references. Returns them as a dict of book key -> entry. Must be called with the lock held."""
+        orphans = [book_key for book_key, count in self.reference_counts().items() if count == 0]
+        return {book_key: self.state["books"].pop(book_key) for book_key in orphans}
+
+    def remove_chat(self, chat_id):
+        """Drops a chat's references and settings. Returns the books no chat references any more, which are removed too."""
+        with self.lock:
+            state = self.load()
+            found = state["chats"].pop(chat_id, None) is not None
+            found = state["staged"].pop(chat_id, None) is not None or found
+            state["settings"].pop(chat_id, None)
+            if not found:
+                return {}
+            orphans = self.remove_orphans()
+            self.save()
+            return orphans
+
+    def rename_chat(self, old_chat_id, new_chat_id):
+        """Moves a chat's references and settings to its new ID."""
+        with self.lock:
+            state = self.load()
+            moved = False
+            for section in ("chats", "settings", "staged"):
+                if old_chat_id in state[section]:
+                    state[section][new_chat_id] = state[section].pop(old_chat_id)
+                    moved = True
+            if moved:
+                self.save()
+
+    def incomplete_books(self):
+        """Returns (book key, [(chat ID, file name), ...]) for every book whose indexing has not finished."""
+        with self.lock:
+            state = self.load()
+            incomplete = {book_key: [] for book_key, book in state["books"].items() if not book.get("complete")}
+            for chat_id, files in state["chats"].items():
+                for filename, book_key in files.items():
+                    if book_key in incomplete:
+                        incomplete[book_key].append((chat_id, filename))
+            return list(incomplete.items())
+
+    def clear(self):
+        """Forgets every book and reference. The caller deletes the store directory."""
+        with self.lock:
+            self.state = self.empty_state()
+
+    def stats(self):
+        """Returns the number of stored books and chat references, and the chunks deduplication avoided storing."""
+        with self.lock:
+            state = self.load()
+            counts = self.reference_counts()
+            chunks_stored = sum(book.get("chunks_committed", 0) for book in state["books"].values())
+            chunks_referenced = sum(book.get("chunks_committed", 0) * counts.get(book_key, 0) for book_key, book in state["books"].items())
+            return {
+                "books": len(state["books"]),
+                "chats": len(state["chats"]),
+                "references": sum(counts.values()),
+                "chunks_stored": chunks_stored,
+                "chunks_deduplicated": max(0, chunks_referenced - chunks_stored),
+                "reindexing": len(state["staged"]),
+            }
+
+registry = DocumentRegistry() # Process-wide registry shared by ingestion, retrieval and the chat routes.
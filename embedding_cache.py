@@ -0,0 +1,181 @@
+from langchain_core.embeddings import Embeddings
+from array import array
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "./embedding_cache/embeddings.sqlite3") # On-disk location of the cache.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 500000)) # Cached vectors kept before LRU eviction, across all models.
+
+class EmbeddingCacheStore:
+    """The SQLite file behind every CachedEmbeddings instance that uses it.
+
+    Vectors of all models share one table, so the size cap, the entry count, eviction and clearing
+    apply to the file as a whole. Instances get their store from get_cache_store, one per path.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = None # Opened on first use so importing processes (e.g. PDF parse workers) never touch the file.
+        self.entry_count = 0
+        self.evictions = 0
+
+    def get_connection(self):
+        """Opens the cache database on first use. Must be called with the lock held."""
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self.connection.commit()
+            self.entry_count = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self.connection
+
+    def lookup(self, keys: list) -> dict:
+        """Returns cached vectors for the given keys and marks them as recently used."""
+        found = {}
+        now = time.time()
+        with self.lock:
+            connection = self.get_connection()
+            for start in range(0, len(keys), 500): # Stays under SQLite's bound-parameter limit.
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    found[key] = array("f", blob).tolist()
+                connection.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [now, *batch])
+            connection.commit()
+        return found
+
+    def store(self, vectors_by_key: dict):
+        """Writes new vectors to the cache, evicting the least recently used entries beyond the size cap."""
+        now = time.time()
+        with self.lock:
+            connection = self.get_connection()
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in vectors_by_key.items()]
+            )
+            self.entry_count += connection.total_changes - before
+
+            overflow = self.entry_count - self.max_entries
+            if overflow > 0:
+                connection.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self.entry_count -= overflow
+                self.evictions += overflow
+            connection.commit()
+
+    def clear(self):
+        """Removes every cached vector of every model."""
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("DELETE FROM embeddings")
+            connection.commit()
+            self.entry_count = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """Returns the size of the cache and the entries evicted from it."""
+        with self.lock:
+            self.get_connection()
+            return {"entries": self.entry_count, "max_entries": self.max_entries, "evictions": self.evictions}
+
+cache_stores = {} # Maps database path -> EmbeddingCacheStore shared by every model cached in it.
+cache_stores_lock = threading.Lock()
+
+def get_cache_store(path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+    """Returns the shared store of a cache database, creating it on first use."""
+    with cache_stores_lock:
+        if path not in cache_stores:
+            cache_stores[path] = EmbeddingCacheStore(path, max_entries)
+        return cache_stores[path]
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that consults a persistent, content-addressed LRU cache before calling the underlying model.
+
+    Entries are keyed by a hash of the embedding model name and the exact text, so identical chunks are
+    only embedded once no matter which file or chat they come from. Instances for different models
+    share the store of their database path; hit and miss counts are kept per instance.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = get_cache_store(path, max_entries)
+        self.lock = threading.Lock() # Guards the hit and miss counters.
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, text: str) -> str:
+        """Returns the content address of a text for this cache's embedding model."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: list) -> list:
+        """Embeds texts, only sending those not already in the cache to the underlying model."""
+        keys = [self.cache_key(text) for text in texts]
+        cached = self.cache.lookup(list(set(keys)))
+
+        missing = {} # Unique uncached texts, so duplicates within one call are embedded once.
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        with self.lock:
+            self.hits += len(texts) - sum(1 for key in keys if key in missing)
+            self.misses += sum(1 for key in keys if key in missing)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), vectors))
+            self.cache.store(new_vectors)
+            cached.update(new_vectors)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        """Embeds a single query text through the cache."""
+        key = self.cache_key(text)
+        cached = self.cache.lookup([key])
+        if key in cached:
+            with self.lock:
+                self.hits += 1
+            return cached[key]
+
+        with self.lock:
+            self.misses += 1
+        vector = self.underlying.embed_query(text)
+        self.cache.store({key: vector})
+        return vector
+
+    def reset_counters(self):
+        """Resets the hit and miss counts."""
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def clear(self):
+        """Removes every cached vector, of all models sharing the database, and resets this instance's counters."""
+        self.cache.clear()
+        self.reset_counters()
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and the current size of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            counters = {
+                "model": self.model_name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        return {**counters, **self.cache.stats()}
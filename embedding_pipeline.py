@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from metrics import record_span
+import os
+import time
+import threading
+
+EMBED_MAX_IN_FLIGHT = int(os.environ.get("EMBED_MAX_IN_FLIGHT", 4)) # Embedding requests allowed to run at once.
+EMBED_INITIAL_BATCH_SIZE = int(os.environ.get("EMBED_INITIAL_BATCH_SIZE", 32)) # Chunks per request before any latency is observed.
+EMBED_MIN_BATCH_SIZE = int(os.environ.get("EMBED_MIN_BATCH_SIZE", 4))
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", 256))
+EMBED_TARGET_BATCH_SECONDS = float(os.environ.get("EMBED_TARGET_BATCH_SECONDS", 2.0)) # Latency the batch size is tuned towards.
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", 3)) # Retries per failed batch before giving up on it.
+EMBED_RETRY_BACKOFF_SECONDS = 0.5 # Base delay between retries, doubled on each attempt.
+
+class EmbeddingPipeline:
+    """Embeds chunk documents in batches and writes each finished batch to a Chroma vector store.
+
+    At most `max_in_flight` batches are being embedded at any time; `add` blocks when that limit is
+    reached, so only a bounded number of chunks is ever held in memory. The batch size grows while
+    batches finish under the target latency and halves when they are slow or fail. A failed batch is
+    retried on its own; if it keeps failing it is reported through `on_batch_failed` and skipped.
+    """
+
+    def __init__(self, vector_store, on_batch_done=None, on_batch_failed=None, chat_id=None, max_in_flight=EMBED_MAX_IN_FLIGHT,
+                 initial_batch_size=EMBED_INITIAL_BATCH_SIZE, min_batch_size=EMBED_MIN_BATCH_SIZE,
+                 max_batch_size=EMBED_MAX_BATCH_SIZE, target_batch_seconds=EMBED_TARGET_BATCH_SECONDS,
+                 max_retries=EMBED_MAX_RETRIES):
+        self.vector_store = vector_store
+        self.embedding_function = vector_store.embeddings
+        self.on_batch_done = on_batch_done
+        self.on_batch_failed = on_batch_failed
+        self.chat_id = chat_id # Only used to label timing spans.
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_batch_seconds = target_batch_seconds
+        self.max_retries = max_retries
+
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed-batch")
+        self.slots = threading.Semaphore(max_in_flight) # Bounds the number of batches in flight.
+        self.write_lock = threading.Lock() # Serializes bulk writes to the Chroma collection.
+        self.stats_lock = threading.Lock()
+        self.pending = []
+        self.futures = []
+
+        self.batch_size = max(min_batch_size, min(initial_batch_size, max_batch_size))
+        self.batches_done = 0
+        self.batches_failed = 0
+        self.retries = 0
+        self.chunks_written = 0
+        self.embed_seconds = 0.0
+
+    def add(self, chunk):
+        """Queues one chunk document, dispatching a batch once enough chunks are pending."""
+        self.pending.append(chunk)
+        if len(self.pending) >= self.batch_size:
+            self.dispatch()
+
+    def add_many(self, chunks):
+        """Queues every chunk document from an iterable."""
+        for chunk in chunks:
+            self.add(chunk)
+
+    def dispatch(self):
+        """Sends the pending chunks as one batch, waiting for a free slot if the in-flight limit is reached."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.slots.acquire()
+        future = self.executor.submit(self.process_batch, batch)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures = [f for f in self.futures if not f.done()]
+        self.futures.append(future)
+
+    def adjust_batch_size(self, seconds, succeeded):
+        """Grows the batch size additively while batches are fast, and halves it when they are slow or fail."""
+        with self.stats_lock:
+            if succeeded and seconds < self.target_batch_seconds:
+                self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+            elif not succeeded or seconds > self.target_batch_seconds * 1.5:
+                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+
+    def process_batch(self, batch):
+        """Embeds and writes a single batch, retrying it with exponential backoff on failure."""
+        texts = [chunk.page_content for chunk in batch]
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self.stats_lock:
+                    self.retries += 1
+                time.sleep(EMBED_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+            started = time.perf_counter()
+            stage, stage_started = "embed", started
+            try:
+                vectors = self.embedding_function.embed_documents(texts)
+                elapsed = time.perf_counter() - started
+                record_span("embed", elapsed, self.chat_id, chunks=len(batch))
+                with self.write_lock:
+                    stage, stage_started = "chroma_write", time.perf_counter()
+                    self.vector_store._collection.upsert(
+                        ids=[chunk.metadata["id"] for chunk in batch],
+                        embeddings=vectors,
+                        documents=texts,
+                        metadatas=[chunk.metadata for chunk in batch]
+                    )
+                    record_span("chroma_write", time.perf_counter() - stage_started, self.chat_id, chunks=len(batch))
+            except Exception as e:
+                last_error = e
+                record_span(stage, time.perf_counter() - stage_started, self.chat_id, error=e)
+                self.adjust_batch_size(time.perf_counter() - started, succeeded=False)
+                print(f"Embedding batch of {len(batch)} chunks failed (attempt {attempt + 1}): {e}")
+                continue
+
+            self.adjust_batch_size(elapsed, succeeded=True)
+            with self.stats_lock:
+                self.batches_done += 1
+                self.chunks_written += len(batch)
+                self.embed_seconds += elapsed
+            if self.on_batch_done:
+                self.on_batch_done(batch)
+            return
+
+        with self.stats_lock:
+            self.batches_failed += 1
+        if self.on_batch_failed:
+            self.on_batch_failed(batch, last_error)
+
+    def close(self):
+        """Flushes any pending chunks, waits for all batches to finish and returns the pipeline statistics."""
+        self.dispatch()
+        wait(self.futures)
+        self.executor.shutdown(wait=True)
+        return self.stats()
+
+    def stats(self):
+        """Returns counters describing the batches processed so far."""
+        with self.stats_lock:
+            return {
+                "batch_size": self.batch_size,
+                "batches_done": self.batches_done,
+                "batches_failed": self.batches_failed,
+                "retries": self.retries,
+                "chunks_written": self.chunks_written,
+                "avg_batch_seconds": round(self.embed_seconds / self.batches_done, 3) if self.batches_done else 0.0,
+            }
@@ -0,0 +1,482 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from vector import get_document_store, get_chat_settings, get_book_key, add_book_to_chat, delete_books, iter_pdf_chunks
+from embedding_pipeline import EmbeddingPipeline
+from answer_cache import answer_cache
+from document_store import registry, file_fingerprint
+from page_cache import has_page_cache
+from lexical_index import lexical_indexes
+from metrics import record_span
+import os
+import time
+import uuid
+import queue
+import threading
+import multiprocessing
+
+INGEST_PARSE_WORKERS = int(os.environ.get("INGEST_PARSE_WORKERS", os.cpu_count() or 2)) # Processes used to parse PDFs in parallel.
+INGEST_JOB_WORKERS = int(os.environ.get("INGEST_JOB_WORKERS", 2)) # Upload jobs that may run at the same time.
+INGEST_PAGE_QUEUE_SIZE = int(os.environ.get("INGEST_PAGE_QUEUE_SIZE", 32)) # Parsed pages buffered between parse workers and the embedder.
+INGEST_CHECKPOINT_INTERVAL_SECONDS = 2.0 # Minimum time between checkpoint writes for one file.
+INGEST_JOB_RETENTION_SECONDS = 3600 # How long finished jobs stay queryable.
+
+ingest_jobs = {} # Stores the state of every known ingestion job, keyed by job ID.
+ingest_jobs_lock = threading.Lock() # Guards all reads and writes of ingest_jobs.
+active_pipelines = {} # Embedding pipelines of running jobs, keyed by job ID, for live batch statistics.
+checkpoint_lock = threading.Lock() # Guards checkpoint trackers and checkpoint writes. Acquired before ingest_jobs_lock.
+indexing_books = {} # Books some job is currently parsing or embedding, keyed by book key, with an event set when it stops.
+indexing_books_lock = threading.Lock() # Guards indexing_books.
+
+job_executor = ThreadPoolExecutor(max_workers=INGEST_JOB_WORKERS, thread_name_prefix="ingest-job") # Runs jobs off the request thread.
+parse_executor = None # Process pool for PDF parsing, created on first use.
+queue_manager = None # Multiprocessing manager that hosts the page queues shared with parse workers.
+parse_executor_lock = threading.Lock()
+
+def get_parse_executor():
+    """Returns the shared process pool used for PDF parsing, creating it on first use."""
+    global parse_executor
+    with parse_executor_lock:
+        if parse_executor is None:
+            parse_executor = ProcessPoolExecutor(max_workers=INGEST_PARSE_WORKERS)
+        return parse_executor
+
+def create_page_queue():
+    """Returns a new bounded queue that parse worker processes can put pages on."""
+    global queue_manager
+    with parse_executor_lock:
+        if queue_manager is None:
+            queue_manager = multiprocessing.Manager()
+        return queue_manager.Queue(maxsize=INGEST_PAGE_QUEUE_SIZE)
+
+def stream_pdf_pages(file_path, start_page, first_chunk, page_queue, book_key=None, settings=None, fingerprint=None):
+    """Runs in a parse worker process: loads a PDF lazily and puts each page's chunks on the page queue.
+
+    The queue is bounded, so a worker blocks instead of getting ahead of the embedding stage. Each
+    page message carries its chunks and the page's load and split times. Pages come from the page
+    text cache when the file has one, so re-chunking never opens the PDF.
+    """
+    filename = os.path.basename(file_path)
+    stage_seconds = {}
+    try:
+        for page_index, chunks in iter_pdf_chunks(file_path, start_page, first_chunk, stage_seconds, book_key, settings, fingerprint):
+            page_queue.put(("page", filename, page_index, (chunks, dict(stage_seconds))))
+        page_queue.put(("done", filename, None, None))
+    except Exception as e:
+        page_queue.put(("error", filename, None, str(e)))
+
+class FileCheckpoint:
+    """Tracks which pages of one book have every chunk committed to Chroma and persists the resulting watermark.
+
+    Batches finish out of order, so the checkpoint only advances over a contiguous run of fully
+    committed pages. Resuming from `pages_committed`/`chunks_committed` never skips uncommitted chunks.
+    Checkpoints live in the document registry, so any chat that uploads the book can resume it.
+    """
+
+    def __init__(self, book_key, filename, start_page=0, first_chunk=0):
+        self.book_key = book_key
+        self.filename = filename
+        self.pages_committed = start_page
+        self.chunks_committed = first_chunk
+        self.remaining_by_page = {} # Uncommitted chunk count of every page handed to the embedder.
+        self.size_by_page = {}
+        self.parsing_done = False
+        self.last_saved = 0.0
+
+    def add_page(self, page_index, chunk_count):
+        """Registers a parsed page and the number of chunks it produced."""
+        self.remaining_by_page[page_index] = chunk_count
+        self.size_by_page[page_index] = chunk_count
+        self.advance()
+
+    def commit_chunk(self, page_index):
+        """Marks one chunk of a page as written to the vector store."""
+        self.remaining_by_page[page_index] -= 1
+        self.advance()
+
+    def advance(self):
+        """Moves the watermark past every leading page whose chunks are all committed."""
+        while self.remaining_by_page.get(self.pages_committed) == 0:
+            del self.remaining_by_page[self.pages_committed]
+            self.chunks_committed += self.size_by_page.pop(self.pages_committed)
+            self.pages_committed += 1
+
+    @property
+    def complete(self):
+        return self.parsing_done and not self.remaining_by_page
+
+    def save(self, force=False):
+        """Writes the checkpoint if it is complete, forced, or the write interval has passed."""
+        if not (force or self.complete) and time.time() - self.last_saved < INGEST_CHECKPOINT_INTERVAL_SECONDS:
+            return
+        registry.update_book(
+            self.book_key,
+            pages_committed=self.pages_committed,
+            chunks_committed=self.chunks_committed,
+            complete=self.complete,
+            updated_at=time.time()
+        )
+        self.last_saved = time.time()
+
+def update_job(job_id, **fields):
+    """Updates top-level fields of a job under the jobs lock."""
+    with ingest_jobs_lock:
+        ingest_jobs[job_id].update(fields)
+
+def update_job_file(job_id, filename, **fields):
+    """Updates the progress fields of one file within a job under the jobs lock."""
+    with ingest_jobs_lock:
+        ingest_jobs[job_id]["files"][filename].update(fields)
+
+def prune_finished_jobs():
+    """Drops finished jobs older than the retention window."""
+    cutoff = time.time() - INGEST_JOB_RETENTION_SECONDS
+    with ingest_jobs_lock:
+        for job_id in [job_id for job_id, job in ingest_jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]:
+            del ingest_jobs[job_id]
+
+def submit_ingest_job(chat_id, pdf_paths, reindex_settings=None, fingerprints=None):
+    """Registers an ingestion job for the given PDF paths and schedules it in the background. Returns the job ID.
+
+    With `reindex_settings`, the job re-indexes the chat's books with those settings; `fingerprints`
+    maps file names to known content hashes, so files with a page text cache are not read at all.
+    """
+    prune_finished_jobs()
+    job_id = str(uuid.uuid4())
+    files = {}
+    for file_path in pdf_paths:
+        files[os.path.basename(file_path)] = {
+            "status": "queued",
+            "pages_parsed": 0,
+            "chunks_total": 0,
+            "chunks_embedded": 0,
+            "resumed_from_page": 0,
+            "deduplicated": False,
+            "error": None,
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    with ingest_jobs_lock:
+        ingest_jobs[job_id] = {
+            "job_id": job_id,
+            "chat_id": chat_id,
+            "kind": "reindex" if reindex_settings else "upload",
+            "settings": reindex_settings or get_chat_settings(chat_id),
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "files": files,
+            "errors": [],
+            "embedding": None,
+        }
+
+    job_executor.submit(run_ingest_job, job_id, chat_id, pdf_paths, reindex_settings, fingerprints)
+    print(f"[{chat_id}] Ingestion job {job_id} queued for {len(pdf_paths)} file(s).")
+    return job_id
+
+def has_active_jobs():
+    """Returns True if any upload or re-index job is queued or running."""
+    with ingest_jobs_lock:
+        return any(not job["finished_at"] for job in ingest_jobs.values())
+
+def chat_has_active_job(chat_id, kind=None):
+    """Returns True if an upload or re-index job of the chat, or one of the given kind, is queued or running."""
+    with ingest_jobs_lock:
+        return any(
+            job["chat_id"] == chat_id and not job["finished_at"] and kind in (None, job["kind"])
+            for job in ingest_jobs.values()
+        )
+
+def submit_reindex_job(chat_id, settings):
+    """Schedules a job that rebuilds a chat's books with new chunking or embedding settings. Returns the job ID.
+
+    Pages are re-chunked from each file's page text cache; a PDF is only parsed again if its cache is
+    missing. The chat keeps searching its current books until every file is re-indexed, then switches
+    over at once and the books it no longer uses are deleted. Raises ValueError if the chat has no books.
+    """
+    staged = registry.staged_chats().get(chat_id)
+    if staged is not None and staged != settings: # A different re-index was interrupted; its partial books are not resumed.
+        delete_books(registry.discard_staged(chat_id))
+
+    pdf_paths = []
+    fingerprints = {}
+    for book_key, filename in registry.chat_books(chat_id).items():
+        file_path = os.path.join(f"./uploaded_pdfs/{chat_id}", filename)
+        fingerprint = (registry.get_book(book_key) or {}).get("fingerprint")
+        if fingerprint is None and os.path.exists(file_path):
+            fingerprint = file_fingerprint(file_path)
+        pdf_paths.append(file_path)
+        fingerprints[filename] = fingerprint
+    if not pdf_paths:
+        raise ValueError(f"Chat {chat_id} has no indexed books.")
+    return submit_ingest_job(chat_id, pdf_paths, reindex_settings=settings, fingerprints=fingerprints)
+
+def record_job_error(job_id, filename, message):
+    """Marks a file as failed and adds the error to the job's error list."""
+    with ingest_jobs_lock:
+        job = ingest_jobs[job_id]
+        job["files"][filename].update({"status": "failed", "error": message, "finished_at": time.time()})
+        job["errors"].append({"file": filename, "error": message})
+
+def count_by_book(chunks):
+    """Counts chunk documents per book key."""
+    counts = {}
+    for chunk in chunks:
+        counts[chunk.metadata["book"]] = counts.get(chunk.metadata["book"], 0) + 1
+    return counts
+
+def claim_book(book_key):
+    """Marks a book as being indexed by the calling job. Returns None on success, or the event of the job already indexing it."""
+    with indexing_books_lock:
+        if book_key in indexing_books:
+            return indexing_books[book_key]
+        indexing_books[book_key] = threading.Event()
+        return None
+
+def release_book(book_key):
+    """Ends the calling job's claim on a book and wakes jobs waiting for it."""
+    with indexing_books_lock:
+        event = indexing_books.pop(book_key, None)
+    if event is not None:
+        event.set()
+
+def complete_from_store(job_id, chat_id, filename, book_key):
+    """Finishes a file whose book the document store already holds. Returns False if the book is not fully indexed."""
+    book = registry.get_book(book_key) or {}
+    if not book.get("complete"):
+        return False
+    print(f"[{chat_id}] {filename} is already in the document store. Reusing it.")
+    answer_cache.invalidate(chat_id) # The chat's answers were cached before it had this book.
+    now = time.time()
+    update_job_file(job_id, filename, status="completed", deduplicated=True, chunks_total=book.get("chunks_committed", 0),
+                    started_at=now, finished_at=now)
+    return True
+
+def run_ingest_job(job_id, chat_id, pdf_paths, reindex_settings=None, fingerprints=None):
+    """Streams the job's PDFs page by page from parallel worker processes into the embedding pipeline.
+
+    Each file is added to the chat as a book of the shared document store. Books the store already
+    holds are reused without parsing or embedding; books another job is indexing are waited for;
+    the rest resume from their checkpoint if an earlier upload of the same content was interrupted.
+    A re-index stages the new books and commits them to the chat only once all of them are complete.
+    """
+    update_job(job_id, status="running", started_at=time.time())
+    settings = reindex_settings or get_chat_settings(chat_id)
+    fingerprints = fingerprints or {}
+    trackers = {} # FileCheckpoint per book key that is being parsed or embedded.
+    deferred = {} # Files whose book another job is indexing, as file name -> (book key, that job's event).
+    unresumable = [] # Files that would fail the same way if the job ran again: missing, or not parseable.
+
+    def on_batch_done(batch):
+        lexical_indexes.add_chunks(batch) # Indexed before the checkpoint can move past these chunks.
+        books = count_by_book(batch)
+        for book_key in books:
+            for member_chat_id in registry.book_chats(book_key): # Answers cached before these chunks existed may now be incomplete.
+                answer_cache.invalidate(member_chat_id)
+        with checkpoint_lock:
+            for chunk in batch:
+                trackers[chunk.metadata["book"]].commit_chunk(chunk.metadata["page"])
+            with ingest_jobs_lock:
+                files = ingest_jobs[job_id]["files"]
+                for book_key, count in books.items():
+                    tracker = trackers[book_key]
+                    tracker.save()
+                    progress = files[tracker.filename]
+                    progress["chunks_embedded"] += count
+                    if progress["status"] == "embedding" and tracker.complete:
+                        progress.update({"status": "completed", "finished_at": time.time()})
+
+    def on_batch_failed(batch, error):
+        for book_key in count_by_book(batch):
+            filename = trackers[book_key].filename
+            print(f"[{chat_id}] Giving up on an embedding batch for {filename}: {error}")
+            record_job_error(job_id, filename, f"Embedding failed after retries: {error}")
+
+    pipeline = None
+    try:
+        vector_store = get_document_store(settings["embedding_model"])
+        pipeline = EmbeddingPipeline(vector_store, on_batch_done=on_batch_done, on_batch_failed=on_batch_failed, chat_id=chat_id)
+        active_pipelines[job_id] = pipeline
+        parse_pool = get_parse_executor()
+        page_queue = create_page_queue()
+
+        futures = {}
+        for file_path in pdf_paths:
+            filename = os.path.basename(file_path)
+            fingerprint = fingerprints.get(filename)
+            if not file_path.endswith(".pdf") or not (os.path.exists(file_path) or (fingerprint and has_page_cache(fingerprint))):
+                record_job_error(job_id, filename, "Not a PDF file or file is missing.")
+                unresumable.append(filename)
+                continue
+
+            fingerprint = fingerprint or file_fingerprint(file_path)
+            book_key = get_book_key(fingerprint, settings)
+            book_fields = {"fingerprint": fingerprint, "embedding_model": settings["embedding_model"]}
+            if reindex_settings:
+                registry.stage_chat_book(chat_id, filename, book_key, reindex_settings, **book_fields)
+            else:
+                add_book_to_chat(chat_id, filename, book_key, **book_fields)
+            if complete_from_store(job_id, chat_id, filename, book_key):
+                continue
+            other_job = claim_book(book_key)
+            if other_job is not None:
+                print(f"[{chat_id}] {filename} is being indexed by another job. Waiting for it.")
+                deferred[filename] = (book_key, other_job)
+                update_job_file(job_id, filename, status="waiting", started_at=time.time())
+                continue
+            if complete_from_store(job_id, chat_id, filename, book_key): # Finished between the first check and the claim.
+                release_book(book_key)
+                continue
+
+            checkpoint = registry.get_book(book_key) or {}
+            start_page = checkpoint.get("pages_committed", 0)
+            first_chunk = checkpoint.get("chunks_committed", 0)
+            if start_page:
+                print(f"[{chat_id}] Resuming {filename} from page {start_page} (chunk {first_chunk}).")
+            trackers[book_key] = FileCheckpoint(book_key, filename, start_page, first_chunk)
+            update_job_file(job_id, filename, status="parsing", started_at=time.time(), resumed_from_page=start_page)
+            futures[filename] = parse_pool.submit(stream_pdf_pages, file_path, start_page, first_chunk, page_queue, book_key,
+                                            settings, fingerprint)
+
+        tracker_by_file = {tracker.filename: tracker for tracker in trackers.values()}
+        parsing = set(futures)
+        while parsing:
+            try:
+                kind, filename, page_index, payload = page_queue.get(timeout=1.0)
+            except queue.Empty:
+                for filename in [name for name in parsing if futures[name].done()]: # Worker exited without reporting back.
+                    error = futures[filename].exception() or "Parse worker exited unexpectedly."
+                    print(f"[{chat_id}] Error parsing {filename}: {error}")
+                    record_job_error(job_id, filename, str(error))
+                    parsing.discard(filename)
+                continue
+
+            if kind == "page":
+                chunks, stage_seconds = payload
+                record_span("load", stage_seconds["load"], chat_id, pages=1)
+                record_span("split", stage_seconds["split"], chat_id, chunks=len(chunks))
+                with checkpoint_lock:
+                    tracker_by_file[filename].add_page(page_index, len(chunks))
+                with ingest_jobs_lock:
+                    progress = ingest_jobs[job_id]["files"][filename]
+                    progress["pages_parsed"] += 1
+                    progress["chunks_total"] += len(chunks)
+                pipeline.add_many(chunks)
+            elif kind == "done":
+                parsing.discard(filename)
+                with checkpoint_lock:
+                    tracker = tracker_by_file[filename]
+                    tracker.parsing_done = True
+                    tracker.save(force=True)
+                    if tracker.complete:
+                        update_job_file(job_id, filename, status="completed", finished_at=time.time())
+                    else:
+                        update_job_file(job_id, filename, status="embedding")
+                print(f"[{chat_id}] Finished parsing {filename}.")
+            elif kind == "error":
+                parsing.discard(filename)
+                print(f"[{chat_id}] Error parsing {filename}: {payload}")
+                record_job_error(job_id, filename, payload)
+                unresumable.append(filename)
+    except Exception as e:
+        print(f"[{chat_id}] Ingestion job {job_id} failed: {e}")
+        with ingest_jobs_lock:
+            ingest_jobs[job_id]["errors"].append({"file": None, "error": str(e)})
+    finally:
+        if pipeline is not None:
+            update_job(job_id, embedding=pipeline.close())
+            active_pipelines.pop(job_id, None)
+        with checkpoint_lock:
+            for tracker in trackers.values():
+                tracker.save(force=True)
+        for book_key in trackers:
+            release_book(book_key)
+
+    for filename, (book_key, other_job) in deferred.items():
+        other_job.wait()
+        if not complete_from_store(job_id, chat_id, filename, book_key):
+            record_job_error(job_id, filename, "Another job indexing the same book did not finish it. Upload the file again to resume.")
+
+    with ingest_jobs_lock:
+        job = ingest_jobs[job_id]
+        failed = [f for f in job["files"].values() if f["status"] != "completed"]
+        if job["errors"] and len(failed) == len(job["files"]):
+            status = "failed"
+        elif job["errors"]:
+            status = "completed_with_errors"
+        else:
+            status = "completed"
+
+    if reindex_settings: # Switched over before the job is reported finished, so no upload can land in between.
+        if status == "completed":
+            delete_books(registry.commit_staged(chat_id))
+            answer_cache.invalidate(chat_id) # Cached answers were built from the old chunks.
+            print(f"[{chat_id}] Switched to the re-indexed books.")
+        elif unresumable: # Kept staged, it would be re-submitted and fail again on every startup.
+            delete_books(registry.discard_staged(chat_id))
+            print(f"[{chat_id}] Re-index failed on {', '.join(unresumable)}. The chat keeps its current books; the staged ones were discarded.")
+        else:
+            print(f"[{chat_id}] Re-index incomplete. The chat keeps its current books; retry to resume.")
+
+    update_job(job_id, status=status, finished_at=time.time())
+    print(f"[{chat_id}] Ingestion job {job_id} finished with status '{status}'.")
+
+def resume_interrupted_ingests():
+    """Queues jobs for every book the registry shows was not fully indexed, using a referencing chat's upload,
+    and for every re-index that was not committed. Returns the job IDs."""
+    pdf_paths_by_chat = {}
+    for book_key, members in registry.incomplete_books():
+        for chat_id, filename in members:
+            file_path = os.path.join(f"./uploaded_pdfs/{chat_id}", filename)
+            if os.path.exists(file_path):
+                pdf_paths_by_chat.setdefault(chat_id, []).append(file_path)
+                break
+
+    job_ids = []
+    for chat_id, pdf_paths in pdf_paths_by_chat.items():
+        print(f"[{chat_id}] Resuming interrupted indexing of {len(pdf_paths)} file(s).")
+        job_ids.append(submit_ingest_job(chat_id, pdf_paths))
+    for chat_id, settings in registry.staged_chats().items():
+        print(f"[{chat_id}] Resuming interrupted re-index.")
+        try:
+            job_ids.append(submit_reindex_job(chat_id, settings))
+        except ValueError as e:
+            print(f"[{chat_id}] Error resuming re-index: {e}")
+            delete_books(registry.discard_staged(chat_id))
+    return job_ids
+
+def rate(count, started_at, finished_at):
+    """Returns count per second over the given interval, or 0.0 if it has not started."""
+    if not started_at:
+        return 0.0
+    elapsed = (finished_at or time.time()) - started_at
+    return round(count / elapsed, 2) if elapsed > 0 else 0.0
+
+def get_pipeline_stats(job_id):
+    """Returns live embedding pipeline statistics for a running job, or None."""
+    pipeline = active_pipelines.get(job_id)
+    return pipeline.stats() if pipeline else None
+
+def get_ingest_job_status(job_id):
+    """Returns a snapshot of a job's progress with throughput figures, or None if the job is unknown."""
+    with ingest_jobs_lock:
+        job = ingest_jobs.get(job_id)
+        if job is None:
+            return None
+        files = {name: dict(progress) for name, progress in job["files"].items()}
+        status = {key: value for key, value in job.items() if key != "files"}
+        status["errors"] = list(job["errors"])
+
+    for progress in files.values():
+        progress["pages_per_second"] = rate(progress["pages_parsed"], progress["started_at"], progress["finished_at"])
+        progress["chunks_per_second"] = rate(progress["chunks_embedded"], progress["started_at"], progress["finished_at"])
+
+    status["files"] = files
+    status["embedding"] = status["embedding"] or get_pipeline_stats(job_id)
+    status["pages_parsed"] = sum(progress["pages_parsed"] for progress in files.values())
+    status["chunks_embedded"] = sum(progress["chunks_embedded"] for progress in files.values())
+    status["chunks_total"] = sum(progress["chunks_total"] for progress in files.values()) # Includes the chunks of reused books.
+    status["files_deduplicated"] = sum(1 for progress in files.values() if progress["deduplicated"])
+    status["pages_per_second"] = rate(status["pages_parsed"], status["started_at"], status["finished_at"])
+    status["chunks_per_second"] = rate(status["chunks_embedded"], status["started_at"], status["finished_at"])
+    return status
@@ -0,0 +1,181 @@
+from document_store import DOCUMENT_STORE_DIR
+from session_cache import LRUCache
+import os
+import re
+import json
+import math
+import heapq
+import threading
+
+LEXICAL_INDEX_DIR = os.path.join(DOCUMENT_STORE_DIR, "lexical") # One BM25 postings file per book, next to the shared Chroma store.
+LEXICAL_INDEX_MAX_BOOKS = int(os.environ.get("LEXICAL_INDEX_MAX_BOOKS", 32)) # Book indexes kept loaded in memory.
+LEXICAL_FAST_PATH_MAX_WORDS = int(os.environ.get("LEXICAL_FAST_PATH_MAX_WORDS", 4)) # Longest name-like query treated as keywords.
+RRF_K = 60 # Reciprocal rank fusion constant; larger values flatten the advantage of top ranks.
+BM25_K1 = 1.5 # Term frequency saturation.
+BM25_B = 0.75 # Document length normalization.
+QUESTION_WORDS = frozenset("what why how who whom whose when where which explain describe summarize summarise compare list tell is are does do can".split())
+QUOTED_PHRASE = re.compile(r'"([^"]+)"|\u201c([^\u201d]+)\u201d')
+SECTION_NUMBER = r"(?:\d+|(?=[ivxlc])c{0,3}(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})(?<=[ivxlc]))" # A number or a valid Roman numeral below 400.
+CHAPTER_REFERENCE = re.compile(rf"\b(?:chapter|part|book|section|page)\s+({SECTION_NUMBER})\b", re.IGNORECASE) # Must end at a word boundary.
+GENERIC_WORDS = frozenset( # Capitalized words that start ordinary short requests rather than names.
+    "main key any give show find overall summary summaries ending beginning tone theme themes plot twist twists "
+    "character characters setting style please more all some every first last best".split()
+)
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have he her his how i in is it its me my of on or "
+    "our she so that the their them then there these they this to was we were what when where which who whom why "
+    "will with would you your about can could into than".split()
+)
+
+def tokenize(text):
+    """Returns the lowercased word tokens of a text, without stopwords."""
+    return [token for token in re.findall(r"\w+", text.lower()) if token not in STOPWORDS]
+
+def quoted_phrases(query):
+    """Returns the quoted phrases of a query, lowercased with whitespace collapsed."""
+    return [normalize_text(first or second) for first, second in QUOTED_PHRASE.findall(query) if (first or second).strip()]
+
+def normalize_text(text):
+    """Lowercases a text and collapses its whitespace, so phrases match across PDF line breaks."""
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+def is_chapter_reference(match, words):
+    """Returns True if a CHAPTER_REFERENCE match is a real reference. A lone "I" is the pronoun far more often
+    than the numeral ("which book I read"), so it only counts when the reference is the whole query."""
+    return match.group(1).lower() != "i" or len(words) == 2
+
+def is_name_like(words):
+    """Returns True if every word is capitalized and none is a question, stop or generic word, as in "Marcus" or "Elena Vance"."""
+    return all(word[0].isupper() and word.lower() not in QUESTION_WORDS | STOPWORDS | GENERIC_WORDS for word in words)
+
+def is_keyword_query(query):
+    """Returns True for keyword-style queries BM25 answers well on its own: quoted phrases, chapter references,
+    and short name-like queries: every word capitalized, and none a question, stop or generic word."""
+    words = re.findall(r"\w+", query.lower())
+    if quoted_phrases(query) or any(is_chapter_reference(match, words) for match in CHAPTER_REFERENCE.finditer(query)):
+        return True
+    return 0 < len(words) <= LEXICAL_FAST_PATH_MAX_WORDS and is_name_like(re.findall(r"\w+", query))
+
+def reciprocal_rank_fusion(ranked_lists, limit):
+    """Merges ranked lists of chunk documents by summing 1 / (RRF_K + rank) per chunk ID. Returns the best `limit` documents."""
+    scores = {}
+    docs = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            doc_id = doc.metadata.get("id")
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs.setdefault(doc_id, doc)
+    return [docs[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)[:limit]]
+
+class BookIndex:
+    """Inverted index of one book's chunks: term -> {chunk index: term frequency}, plus every chunk's length."""
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = {}
+        self.total_length = 0
+
+    def add(self, chunk_index, length, terms):
+        """Adds one chunk's term frequencies, replacing the chunk if it was indexed before."""
+        if chunk_index in self.lengths:
+            self.total_length -= self.lengths[chunk_index]
+            for chunk_postings in self.postings.values():
+                chunk_postings.pop(chunk_index, None)
+        self.lengths[chunk_index] = length
+        self.total_length += length
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[chunk_index] = frequency
+
+class LexicalIndexStore:
+    """BM25 indexes of every book in the document store, built at ingest time from the same chunks Chroma stores.
+
+    Each book's index is an append-only JSONL file of chunk term frequencies, so chunks committed
+    before an interrupted ingest stay indexed and re-indexed chunks simply replace earlier lines.
+    Loaded indexes are kept in an LRU cache and updated in place as new chunks arrive.
+    """
+
+    def __init__(self, directory=LEXICAL_INDEX_DIR, max_books=LEXICAL_INDEX_MAX_BOOKS):
+        self.directory = directory
+        self.indexes = LRUCache("lexical_indexes", max_entries=max_books, ttl_seconds=float("inf"))
+        self.lock = threading.Lock() # Serializes index file appends and in-memory updates against searches.
+
+    def get_path(self, book_key):
+        return os.path.join(self.directory, f"{book_key}.jsonl")
+
+    def load(self, book_key):
+        """Returns a book's index, loading it from disk on a cache miss. Must be called with the lock held."""
+        index = self.indexes.get(book_key)
+        if index is not None:
+            return index
+        index = BookIndex()
+        path = self.get_path(book_key)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # A torn last line from an interrupted write.
+                    index.add(entry["chunk"], entry["length"], entry["terms"])
+        self.indexes.put(book_key, index)
+        return index
+
+    def add_chunks(self, chunks):
+        """Indexes chunk documents tagged with a book key, appending them to each book's index file."""
+        lines_by_book = {}
+        for chunk in chunks:
+            tokens = tokenize(chunk.page_content)
+            terms = {}
+            for token in tokens:
+                terms[token] = terms.get(token, 0) + 1
+            entry = {"chunk": chunk.metadata["chunk"], "length": len(tokens), "terms": terms}
+            lines_by_book.setdefault(chunk.metadata["book"], []).append(entry)
+
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for book_key, entries in lines_by_book.items():
+                with open(self.get_path(book_key), "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+                index = self.indexes.get(book_key)
+                if index is not None:
+                    for entry in entries:
+                        index.add(entry["chunk"], entry["length"], entry["terms"])
+
+    def search(self, book_keys, query, limit):
+        """Scores the chunks of the given books against a query with BM25. Returns up to `limit` (book key, chunk index) pairs, best first."""
+        query_terms = set(tokenize(query))
+        if not query_terms or not book_keys:
+            return []
+        with self.lock:
+            indexes = [(book_key, self.load(book_key)) for book_key in book_keys]
+            chunk_count = sum(len(index.lengths) for _, index in indexes)
+            if not chunk_count:
+                return []
+            average_length = sum(index.total_length for _, index in indexes) / chunk_count or 1.0
+            scores = {}
+            for term in query_terms:
+                document_frequency = sum(len(index.postings.get(term, ())) for _, index in indexes)
+                if not document_frequency:
+                    continue
+                idf = math.log(1 + (chunk_count - document_frequency + 0.5) / (document_frequency + 0.5))
+                for book_key, index in indexes:
+                    for chunk_index, frequency in index.postings.get(term, {}).items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * index.lengths[chunk_index] / average_length)
+                        key = (book_key, chunk_index)
+                        scores[key] = scores.get(key, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return [key for key, _ in heapq.nlargest(limit, scores.items(), key=lambda item: item[1])]
+
+    def delete(self, book_keys):
+        """Removes the indexes of books deleted from the document store."""
+        with self.lock:
+            for book_key in book_keys:
+                self.indexes.pop(book_key)
+                if os.path.exists(self.get_path(book_key)):
+                    os.remove(self.get_path(book_key))
+
+    def clear(self):
+        """Forgets every loaded index. The caller deletes the index directory."""
+        with self.lock:
+            self.indexes.clear()
+
+lexical_indexes = LexicalIndexStore() # Process-wide BM25 indexes shared by ingestion and retrieval.
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import threading
+
+METRICS_LOG_SPANS = os.environ.get("METRICS_LOG_SPANS", "0") == "1" # Prints every timing span as a JSON line.
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0) # Histogram bounds in seconds.
+
+def escape_label_value(value):
+    """Escapes backslashes, quotes and newlines in a label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    """Formats (name, value) label pairs in Prometheus exposition syntax."""
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+class Counter:
+    """Monotonic counter with one value per label combination."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {} # Maps label values tuple -> count.
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Adds `amount` to the series of the given labels."""
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        """Returns the metric's exposition lines."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(zip(self.label_names, key))} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label combination."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {} # Maps label values tuple -> [bucket counts..., sum, count].
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Records one value in the series of the given labels."""
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        """Returns the metric's exposition lines."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                labels = list(zip(self.label_names, key))
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(labels + [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(labels + [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {round(series[-2], 6)}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {series[-1]}")
+        return lines
+
+class MetricsRegistry:
+    """Holds every metric of the process and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, label_names=()):
+        """Creates and registers a counter."""
+        metric = Counter(name, help_text, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=STAGE_BUCKETS):
+        """Creates and registers a histogram."""
+        metric = Histogram(name, help_text, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Returns every registered metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry() # Process-wide registry exposed by the /metrics endpoint.
+
+stage_seconds = registry.histogram("bookanalyzer_stage_seconds", "Time spent in each chat and ingest stage.", ["stage"])
+stage_errors = registry.counter("bookanalyzer_stage_errors_total", "Stage executions that raised an error.", ["stage"])
+stage_items = registry.counter("bookanalyzer_stage_items_total", "Items handled by each stage, such as chunks or tokens.", ["stage", "item"])
+retrieval_queries = registry.counter("bookanalyzer_retrieval_queries_total", "Retriever queries by path: lexical fast path, hybrid or vector only.", ["mode"])
+chat_request_seconds = registry.histogram("bookanalyzer_chat_request_seconds", "End-to-end time of /chat requests.", ["outcome"])
+
+def record_span(stage, seconds, chat_id=None, timings=None, error=None, **sizes):
+    """Records one timed stage: observes its histogram, counts its sizes and adds it to a per-request breakdown.
+
+    `timings` is an optional dict of stage -> milliseconds collected for a single request; repeated
+    stages are summed. Sizes are counts such as chunks, prompt_tokens or output_tokens.
+    """
+    stage_seconds.observe(seconds, stage=stage)
+    for item, amount in sizes.items():
+        stage_items.inc(amount, stage=stage, item=item)
+    if error is not None:
+        stage_errors.inc(stage=stage)
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 2)
+    if METRICS_LOG_SPANS:
+        entry = {"span": stage, "chat_id": chat_id, "ms": round(seconds * 1000, 2), **sizes}
+        if error is not None:
+            entry["error"] = str(error)
+        print(json.dumps(entry))
+
+class span:
+    """Context manager that times a block as one stage. Sizes known only inside the block can be set on `sizes`."""
+
+    def __init__(self, stage, chat_id=None, timings=None, **sizes):
+        self.stage = stage
+        self.chat_id = chat_id
+        self.timings = timings
+        self.sizes = sizes
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        record_span(self.stage, time.perf_counter() - self.started, self.chat_id, self.timings, exc, **self.sizes)
+        return False
@@ -0,0 +1,84 @@
+from document_store import DOCUMENT_STORE_DIR
+import os
+import mmap
+import struct
+
+PAGE_CACHE_DIR = os.path.join(DOCUMENT_STORE_DIR, "pages") # Extracted page text of every uploaded file, keyed by its SHA-256.
+PAGE_CACHE_MAGIC = b"BKPAGES1"
+FOOTER = struct.Struct("<Q8s") # Page count, magic.
+
+# File layout: the UTF-8 text of every page back to back, then (page count + 1) little-endian uint64
+# offsets into that text, then the footer. Pages are written in one pass as they are parsed, and any
+# page is read by slicing the memory map between two offsets, without loading the rest of the file.
+
+def page_cache_path(fingerprint):
+    """Returns the path of the page text cache of a file with the given SHA-256."""
+    return os.path.join(PAGE_CACHE_DIR, f"{fingerprint}.pages")
+
+def has_page_cache(fingerprint):
+    return os.path.exists(page_cache_path(fingerprint))
+
+class PageCacheWriter:
+    """Writes a file's page texts to a temporary file and publishes the cache atomically on `commit`."""
+
+    def __init__(self, fingerprint):
+        os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+        self.path = page_cache_path(fingerprint)
+        self.temp_path = f"{self.path}.{os.getpid()}.tmp"
+        self.file = open(self.temp_path, "wb")
+        self.offsets = [0]
+
+    def add_page(self, text):
+        """Appends the text of the next page."""
+        data = text.encode("utf-8", errors="surrogatepass")
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def commit(self):
+        """Writes the offset table and footer and moves the finished cache into place."""
+        self.file.write(struct.pack(f"<{len(self.offsets)}Q", *self.offsets))
+        self.file.write(FOOTER.pack(len(self.offsets) - 1, PAGE_CACHE_MAGIC))
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        """Drops a partially written cache, e.g. when parsing fails."""
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class PageCache:
+    """Read-only, memory-mapped view of a file's cached page texts. Use as a context manager."""
+
+    def __init__(self, fingerprint):
+        self.file = open(page_cache_path(fingerprint), "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        page_count, magic = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != PAGE_CACHE_MAGIC:
+            self.close()
+            raise ValueError(f"{page_cache_path(fingerprint)} is not a page cache file.")
+        table_start = len(self.map) - FOOTER.size - 8 * (page_count + 1)
+        self.offsets = struct.unpack_from(f"<{page_count + 1}Q", self.map, table_start)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def page(self, page_index):
+        """Returns the text of one page."""
+        return self.map[self.offsets[page_index]:self.offsets[page_index + 1]].decode("utf-8", errors="surrogatepass")
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+def delete_page_cache(fingerprint):
+    """Removes the page cache of a file no stored book is built from any more."""
+    if has_page_cache(fingerprint):
+        os.remove(page_cache_path(fingerprint))
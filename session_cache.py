@@ -0,0 +1,138 @@
+from collections import OrderedDict
+import os
+import time
+import threading
+
+SESSION_CACHE_MAX_CHATS = int(os.environ.get("SESSION_CACHE_MAX_CHATS", 64)) # Chats kept warm in each per-chat cache.
+SESSION_CACHE_TTL_SECONDS = float(os.environ.get("SESSION_CACHE_TTL_SECONDS", 1800)) # Idle time after which a chat's state is dropped.
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry beyond `max_entries`
+    and any entry not accessed for `ttl_seconds`, while counting hits and misses."""
+
+    def __init__(self, name, max_entries=SESSION_CACHE_MAX_CHATS, ttl_seconds=SESSION_CACHE_TTL_SECONDS):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict() # Maps key -> (value, last access time), least recently used first.
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def expire(self, now):
+        """Drops idle entries from the least recently used end. Must be called with the lock held."""
+        while self.entries:
+            key, (_, last_access) = next(iter(self.entries.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            del self.entries[key]
+            self.expirations += 1
+
+    def get(self, key):
+        """Returns the cached value for a key, or None, refreshing its recency on a hit."""
+        now = time.time()
+        with self.lock:
+            self.expire(now)
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            value, _ = self.entries.pop(key)
+            self.entries[key] = (value, now)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores a value as the most recently used entry, evicting the oldest entries beyond the cap."""
+        now = time.time()
+        with self.lock:
+            self.expire(now)
+            self.entries.pop(key, None)
+            self.entries[key] = (value, now)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        """Returns the cached value for a key, building and caching it with `factory` on a miss.
+
+        The factory runs outside the lock; if another thread cached the key meanwhile, its value wins.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        created = factory()
+        with self.lock:
+            if key in self.entries:
+                value, _ = self.entries.pop(key)
+                self.entries[key] = (value, time.time())
+                return value
+        self.put(key, created)
+        return created
+
+    def pop(self, key):
+        """Removes a key and returns its value, or None if it was not cached."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def clear(self):
+        """Removes every entry. Counters are kept."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Returns the size, hit rate and eviction counters of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+class SessionManager:
+    """Keeps the warm per-chat state of the server in bounded LRU caches.
+
+    Histories and retrievers are keyed by chat ID; vector stores by document store directory and
+    embedding model, since chats share them; Chroma clients by persist directory. Anything evicted is
+    rebuilt from disk on demand.
+    """
+
+    def __init__(self, max_entries=SESSION_CACHE_MAX_CHATS, ttl_seconds=SESSION_CACHE_TTL_SECONDS):
+        self.histories = LRUCache("histories", max_entries, ttl_seconds)
+        self.retrievers = LRUCache("retrievers", max_entries, ttl_seconds)
+        self.vector_stores = LRUCache("vector_stores", max_entries, ttl_seconds)
+        self.chroma_clients = LRUCache("chroma_clients", max_entries, ttl_seconds)
+
+    def rename_chat(self, old_chat_id, new_chat_id, old_persist_directory):
+        """Moves a chat's history to its new ID and drops state tied to its old ID and Chroma directory.
+
+        The shared vector stores are not keyed by chat, so they stay cached.
+        """
+        history = self.histories.pop(old_chat_id)
+        if history is not None:
+            self.histories.put(new_chat_id, history)
+        self.retrievers.pop(old_chat_id)
+        self.chroma_clients.pop(old_persist_directory)
+
+    def clear(self):
+        """Drops all cached per-chat state."""
+        for cache in (self.histories, self.retrievers, self.vector_stores, self.chroma_clients):
+            cache.clear()
+
+    def stats(self):
+        """Returns the statistics of every session cache."""
+        return {cache.name: cache.stats() for cache in (self.histories, self.retrievers, self.vector_stores, self.chroma_clients)}
+
+sessions = SessionManager() # Process-wide session state shared by the app and the vector store helpers.
@@ -0,0 +1,83 @@
+from concurrent.futures import Future
+import asyncio
+import threading
+
+class SingleFlight:
+    """Coalesces concurrent calls by key: the first caller computes, callers arriving while it runs share its result.
+
+    Nothing is cached once the computation finishes; only calls that overlap in time are merged.
+    Exceptions are shared the same way as results.
+    """
+
+    def __init__(self):
+        self.calls = {} # Maps key -> Future of the computation in flight.
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Returns (result of fn, whether it was shared with a computation already in flight)."""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+        future.set_result(result)
+        return result, False
+
+    def stats(self):
+        """Returns the number of computations run, calls merged into them and computations in flight."""
+        with self.lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self.calls)}
+
+class AsyncSingleFlight:
+    """Event-loop version of SingleFlight. The computation runs as its own task and is cancelled only when
+    every caller waiting for it has gone away, so one disconnecting client does not fail the others."""
+
+    def __init__(self):
+        self.calls = {} # Maps key -> [task, number of callers waiting for it].
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        """Returns (result of the coroutine made by factory, whether it was shared with a computation already in flight)."""
+        entry = self.calls.get(key)
+        leader = entry is None
+        if leader:
+            entry = [asyncio.ensure_future(factory()), 0]
+            self.calls[key] = entry
+            entry[0].add_done_callback(lambda _: self.calls.pop(key, None) if self.calls.get(key) is entry else None)
+            self.executed += 1
+        else:
+            self.coalesced += 1
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if not entry[1] and not task.done():
+                if self.calls.get(key) is entry: # Later callers start a fresh computation instead of joining a cancelled one.
+                    del self.calls[key]
+                task.cancel()
+        return result, not leader
+
+    def stats(self):
+        """Returns the number of computations run, calls merged into them and computations in flight."""
+        return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self.calls)}
@@ -0,0 +1,309 @@
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.prompts import ChatPromptTemplate
+from vector import get_source_chunks
+from lexical_index import SECTION_NUMBER
+from tokens import estimate_tokens
+from metrics import span
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+SUMMARY_MAX_CONCURRENCY = int(os.environ.get("SUMMARY_MAX_CONCURRENCY", 4)) # LLM calls all summary jobs may run at once.
+SUMMARY_SECTION_MAX_CHUNKS = int(os.environ.get("SUMMARY_SECTION_MAX_CHUNKS", 24)) # Section size when a book has no chapter headings, and the cap otherwise.
+SUMMARY_REDUCE_TOKEN_BUDGET = int(os.environ.get("SUMMARY_REDUCE_TOKEN_BUDGET", 3000)) # Maximum tokens of summaries combined by one reduce call.
+SUMMARY_JOB_RETENTION_SECONDS = 3600 # How long finished summary jobs stay queryable.
+SUMMARY_CACHE_FILENAME = "summaries.jsonl" # Per-chat cache of partial summaries, kept inside the chat's Chroma directory.
+NUMBER_WORD = (
+    r"(?:(?:twenty|thirty|forty|fifty)(?:-(?:one|two|three|four|five|six|seven|eight|nine))?|one|two|three|four|five|six|seven|eight|nine|ten"
+    r"|eleven|twelve|thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen)"
+)
+CHAPTER_HEADING = re.compile( # A heading line: "Chapter 3", "Part IV", "Book Two", optionally followed by a separated title ("Chapter 3: The Storm").
+    rf"^[ \t]*((?:chapter|part|book)[ \t]+(?:{SECTION_NUMBER}|{NUMBER_WORD}))\b(?:[ \t]*[:.\u2013\u2014-][^\n]*)?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+map_template = """
+Summarize the following excerpt from the document "{source}".
+Keep the names, events, arguments and key facts it contains. Write one short paragraph and do not add anything that is not in the excerpt.
+
+Excerpt:
+{text}
+
+Summary:
+"""
+
+reduce_template = """
+Below are summaries of consecutive parts of {scope} of the document "{source}", in order.
+Combine them into one coherent summary that keeps the main events, arguments, names and key facts in their original order.
+
+Summaries:
+{text}
+
+Combined summary:
+"""
+
+map_prompt = ChatPromptTemplate.from_template(map_template)
+reduce_prompt = ChatPromptTemplate.from_template(reduce_template)
+
+summary_jobs = {} # Stores the state of every known summary job, keyed by job ID.
+summary_jobs_lock = threading.Lock() # Guards all reads and writes of summary_jobs.
+llm_executor = ThreadPoolExecutor(max_workers=SUMMARY_MAX_CONCURRENCY, thread_name_prefix="summary-llm") # Bounds LLM concurrency.
+job_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary-job") # Runs jobs off the request thread.
+
+class SummaryStore:
+    """Append-only cache of partial summaries for one chat, keyed by a hash of each summary's prompt inputs.
+
+    Entries are never invalidated: changed text produces a different key, so repeat runs and newly
+    added books only ask the LLM for summaries that do not exist yet.
+    """
+
+    def __init__(self, chat_id):
+        self.path = os.path.join(f"./chroma_db/{chat_id}", SUMMARY_CACHE_FILENAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # A torn last line from an interrupted write.
+                    self.entries[entry["key"]] = entry["summary"]
+
+    def get(self, key):
+        """Returns the cached summary for a key, or None."""
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, summary):
+        """Stores a summary in memory and appends it to the cache file with a single write.
+
+        Nothing is written once the chat's directory is gone, so a job outliving its chat cannot bring it back.
+        """
+        with self.lock:
+            self.entries[key] = summary
+            if not os.path.isdir(os.path.dirname(self.path)):
+                return
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps({"key": key, "summary": summary}) + "\n").encode("utf-8"))
+            finally:
+                os.close(fd)
+
+def summary_key(kind, model_name, inputs):
+    """Returns the cache key of a summary from its prompt kind, model and prompt inputs."""
+    return hashlib.sha256(json.dumps([kind, model_name, inputs], sort_keys=True).encode("utf-8")).hexdigest()
+
+def split_into_sections(chunks):
+    """Groups a book's chunks into sections that start at chapter headings.
+
+    Returns (title, chunk indexes, texts) tuples. Books without headings are cut into sections of
+    SUMMARY_SECTION_MAX_CHUNKS chunks, and long chapters are split at the same size.
+    """
+    sections = []
+    current_title = None
+    for chunk_index, text in chunks:
+        match = CHAPTER_HEADING.search(text)
+        heading = match.group(1).strip().title() if match else None
+        new_chapter = heading is not None and heading != current_title # Overlapping chunks repeat the same heading.
+        if not sections or new_chapter or len(sections[-1][1]) >= SUMMARY_SECTION_MAX_CHUNKS:
+            if new_chapter:
+                current_title = heading
+            sections.append((current_title, [], []))
+        sections[-1][1].append(chunk_index)
+        sections[-1][2].append(text)
+    return [(title or f"Chunks {indexes[0]}-{indexes[-1]}", indexes, texts) for title, indexes, texts in sections]
+
+def group_by_budget(texts, token_budget=SUMMARY_REDUCE_TOKEN_BUDGET):
+    """Packs consecutive texts into groups within the token budget. Every group holds at least two texts
+    when possible, so each reduce level at least halves the number of summaries."""
+    groups = []
+    used = 0
+    for text in texts:
+        cost = estimate_tokens(text)
+        if groups and (len(groups[-1]) < 2 or used + cost <= token_budget):
+            groups[-1].append(text)
+            used += cost
+        else:
+            groups.append([text])
+            used = cost
+    return groups
+
+class BookSummarizer:
+    """Summarizes one chat's books by mapping over every chunk and reducing hierarchically: chunk, section, book."""
+
+    def __init__(self, chat_id, llm, store, on_progress=None):
+        self.chat_id = chat_id
+        self.llm = llm
+        self.model_name = getattr(llm, "model", "unknown")
+        self.store = store
+        self.on_progress = on_progress
+
+    def summarize(self, kind, inputs):
+        """Returns the summary for one prompt, from the cache or from the LLM."""
+        key = summary_key(kind, self.model_name, inputs)
+        summary = self.store.get(key)
+        if summary is not None:
+            self.report(kind, cached=True)
+            return summary
+        prompt = map_prompt if kind == "map" else reduce_prompt
+        with span(f"summarize_{kind}", self.chat_id) as summary_span:
+            summary = self.llm.invoke(prompt.invoke(inputs)).strip()
+            summary_span.sizes["output_tokens"] = estimate_tokens(summary)
+        self.store.put(key, summary)
+        self.report(kind, cached=False)
+        return summary
+
+    def summarize_many(self, kind, inputs_list):
+        """Summarizes several prompts in parallel on the shared LLM pool, returning results in order."""
+        futures = [llm_executor.submit(self.summarize, kind, inputs) for inputs in inputs_list]
+        return [future.result() for future in futures]
+
+    def reduce(self, source, scope, summaries):
+        """Combines summaries into one, in as many levels as the reduce token budget requires."""
+        while len(summaries) > 1:
+            groups = group_by_budget(summaries)
+            summaries = self.summarize_many("reduce", [
+                {"source": source, "scope": scope, "text": "\n\n".join(group)} for group in groups
+            ])
+        return summaries[0]
+
+    def summarize_book(self, source):
+        """Returns the book summary and the summary of every section of one source file."""
+        chunks = get_source_chunks(self.chat_id, source)
+        if not chunks:
+            raise ValueError(f"No indexed chunks found for {source}.")
+        sections = split_into_sections(chunks)
+        self.report("start", chunks=len(chunks), sections=len(sections))
+
+        chunk_summaries = self.summarize_many("map", [{"source": source, "text": text} for _, text in chunks])
+        by_chunk = dict(zip((chunk_index for chunk_index, _ in chunks), chunk_summaries))
+
+        # Sections reduce concurrently; their LLM calls still share the bounded llm_executor.
+        with ThreadPoolExecutor(max_workers=min(len(sections), SUMMARY_MAX_CONCURRENCY), thread_name_prefix="summary-section") as reducers:
+            section_summaries = list(reducers.map(
+                lambda section: self.reduce(source, section[0], [by_chunk[i] for i in section[1]]),
+                sections
+            ))
+        book_summary = self.reduce(source, "the whole document", [
+            f"{title}: {summary}" for (title, _, _), summary in zip(sections, section_summaries)
+        ]) if len(sections) > 1 else section_summaries[0]
+        return {
+            "summary": book_summary,
+            "sections": [
+                {"title": title, "chunks": [indexes[0], indexes[-1]], "summary": summary}
+                for (title, indexes, _), summary in zip(sections, section_summaries)
+            ],
+        }
+
+    def report(self, event, **details):
+        """Passes a progress event to the job's callback."""
+        if self.on_progress:
+            self.on_progress(event, **details)
+
+def prune_finished_jobs():
+    """Drops finished summary jobs older than the retention window."""
+    cutoff = time.time() - SUMMARY_JOB_RETENTION_SECONDS
+    with summary_jobs_lock:
+        for job_id in [job_id for job_id, job in summary_jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]:
+            del summary_jobs[job_id]
+
+def has_active_summary_jobs():
+    """Returns True if any summary job is queued or running."""
+    with summary_jobs_lock:
+        return any(not job["finished_at"] for job in summary_jobs.values())
+
+def chat_has_active_summary_job(chat_id):
+    """Returns True if a summary job of the chat is queued or running."""
+    with summary_jobs_lock:
+        return any(job["chat_id"] == chat_id and not job["finished_at"] for job in summary_jobs.values())
+
+def submit_summary_job(chat_id, llm, source_files):
+    """Registers a summary job for the given source files of a chat and schedules it in the background. Returns the job ID."""
+    prune_finished_jobs()
+    job_id = str(uuid.uuid4())
+    files = {}
+    for source in source_files:
+        files[source] = {
+            "status": "queued",
+            "chunks": 0,
+            "sections": 0,
+            "map_done": 0,
+            "reduce_done": 0,
+            "cached": 0,
+            "generated": 0,
+            "error": None,
+        }
+
+    with summary_jobs_lock:
+        summary_jobs[job_id] = {
+            "job_id": job_id,
+            "chat_id": chat_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "files": files,
+            "summaries": {},
+        }
+
+    job_executor.submit(run_summary_job, job_id, chat_id, llm, source_files)
+    print(f"[{chat_id}] Summary job {job_id} queued for {len(source_files)} file(s).")
+    return job_id
+
+def run_summary_job(job_id, chat_id, llm, source_files):
+    """Summarizes each source file in turn, recording progress and the finished summaries on the job."""
+    with summary_jobs_lock:
+        summary_jobs[job_id].update(status="running", started_at=time.time())
+    store = SummaryStore(chat_id)
+
+    for source in source_files:
+        if not os.path.isdir(os.path.dirname(store.path)):
+            with summary_jobs_lock:
+                summary_jobs[job_id]["files"][source].update(status="failed", error="The chat was deleted.")
+            continue
+
+        def on_progress(event, cached=False, **details):
+            with summary_jobs_lock:
+                progress = summary_jobs[job_id]["files"][source]
+                if event == "start":
+                    progress.update(status="summarizing", **details)
+                    return
+                progress[f"{event}_done"] += 1
+                progress["cached" if cached else "generated"] += 1
+
+        try:
+            result = BookSummarizer(chat_id, llm, store, on_progress).summarize_book(source)
+        except Exception as e:
+            print(f"[{chat_id}] Error summarizing {source}: {e}")
+            with summary_jobs_lock:
+                summary_jobs[job_id]["files"][source].update(status="failed", error=str(e))
+            continue
+        with summary_jobs_lock:
+            summary_jobs[job_id]["files"][source]["status"] = "completed"
+            summary_jobs[job_id]["summaries"][source] = result
+        print(f"[{chat_id}] Summarized {source}.")
+
+    with summary_jobs_lock:
+        job = summary_jobs[job_id]
+        failed = [f for f in job["files"].values() if f["status"] != "completed"]
+        if not failed:
+            job["status"] = "completed"
+        elif len(failed) == len(job["files"]):
+            job["status"] = "failed"
+        else:
+            job["status"] = "completed_with_errors"
+        job["finished_at"] = time.time()
+    print(f"[{chat_id}] Summary job {job_id} finished with status '{job['status']}'.")
+
+def get_summary_job_status(job_id):
+    """Returns a snapshot of a summary job's progress and any finished summaries, or None if the job is unknown."""
+    with summary_jobs_lock:
+        job = summary_jobs.get(job_id)
+        if job is None:
+            return None
+        return json.loads(json.dumps(job))
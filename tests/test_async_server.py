@@ -0,0 +1,50 @@
+import asyncio
+
+from async_server import FairGenerationScheduler
+
+async def generate(scheduler, order, name, chat_id, gate=None):
+    await scheduler.acquire(chat_id)
+    order.append(name)
+    if gate:
+        await gate.wait()
+    scheduler.release()
+
+def test_slots_rotate_between_chats_and_skip_cancelled_waiters():
+    async def scenario():
+        scheduler = FairGenerationScheduler(max_concurrent=1)
+        order = []
+        gate = asyncio.Event()
+        tasks = {"A0": asyncio.create_task(generate(scheduler, order, "A0", "A", gate))}
+        for name in ("A1", "A2", "A3", "B0", "B1"):
+            tasks[name] = asyncio.create_task(generate(scheduler, order, name, name[0]))
+        await asyncio.sleep(0)
+        tasks["A2"].cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return scheduler, order, tasks
+
+    scheduler, order, tasks = asyncio.run(scenario())
+    assert order == ["A0", "A1", "B0", "A3", "B1"]
+    assert tasks["A2"].cancelled()
+    assert scheduler.active == 0
+    assert not scheduler.waiting and not scheduler.rotation
+
+def test_waiter_cancelled_after_the_handover_passes_its_slot_on():
+    async def scenario():
+        scheduler = FairGenerationScheduler(max_concurrent=1)
+        order = []
+        await scheduler.acquire("A")
+        waiter_b = asyncio.create_task(generate(scheduler, order, "B0", "B"))
+        waiter_c = asyncio.create_task(generate(scheduler, order, "C0", "C"))
+        await asyncio.sleep(0)
+        scheduler.release() # Hands the slot to B0, which is cancelled before it resumes.
+        waiter_b.cancel()
+        await asyncio.gather(waiter_b, waiter_c, return_exceptions=True)
+        return scheduler, order, waiter_b
+
+    scheduler, order, waiter_b = asyncio.run(scenario())
+    assert waiter_b.cancelled()
+    assert order == ["C0"]
+    assert scheduler.active == 0
+    assert not scheduler.waiting and not scheduler.rotation
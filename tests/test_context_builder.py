@@ -0,0 +1,39 @@
+from langchain_core.documents import Document
+
+from context_builder import assemble_context
+from vector import get_text_splitter
+
+SOURCE_TEXT = " ".join(f"Sentence {i} tells of the harbour, the lighthouse keeper and ship number {i * 7}." for i in range(60))
+
+def split_source(chunk_size=200, chunk_overlap=50):
+    return get_text_splitter(chunk_size, chunk_overlap).split_text(SOURCE_TEXT)
+
+def make_doc(chunks, index, source="book.pdf"):
+    return Document(page_content=chunks[index], metadata={"source_file": source, "chunk": index})
+
+def test_neighbouring_splitter_chunks_merge_into_the_exact_source_span():
+    chunks = split_source()
+    n = 3
+    docs = [make_doc(chunks, n + 2), make_doc(chunks, n), make_doc(chunks, n + 1)]
+    context, used_docs, stats = assemble_context(docs, token_budget=10000)
+
+    start = SOURCE_TEXT.index(chunks[n])
+    end = SOURCE_TEXT.index(chunks[n + 2]) + len(chunks[n + 2])
+    assert context == f"[Source: book.pdf, Chunks: {n}-{n + 2}]\n{SOURCE_TEXT[start:end]}"
+    assert stats["passages"] == 1
+    assert len(used_docs) == 3
+
+def test_repeated_chunk_is_included_once():
+    chunks = split_source()
+    context, _, stats = assemble_context([make_doc(chunks, 4), make_doc(chunks, 4)], token_budget=10000)
+    assert context == f"[Source: book.pdf, Chunk: 4]\n{chunks[4]}"
+    assert stats["passages"] == 1
+
+def test_passage_over_the_budget_is_skipped_and_later_ones_still_packed():
+    long_doc = Document(page_content="x" * 2000, metadata={"source_file": "long.pdf", "chunk": 0})
+    short_doc = Document(page_content="A short passage.", metadata={"source_file": "short.pdf", "chunk": 0})
+    context, used_docs, stats = assemble_context([long_doc, short_doc], token_budget=100)
+    assert context == "[Source: short.pdf, Chunk: 0]\nA short passage."
+    assert used_docs == [short_doc]
+    assert stats["passages_skipped"] == 1
+    assert stats["tokens_after"] <= 100
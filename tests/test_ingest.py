@@ -0,0 +1,40 @@
+from ingest import FileCheckpoint
+
+def test_watermark_waits_for_earlier_pages_when_chunks_commit_out_of_order():
+    checkpoint = FileCheckpoint("book", "book.pdf")
+    checkpoint.add_page(0, 2)
+    checkpoint.add_page(1, 1)
+    checkpoint.commit_chunk(1)
+    assert (checkpoint.pages_committed, checkpoint.chunks_committed) == (0, 0)
+    checkpoint.commit_chunk(0)
+    assert (checkpoint.pages_committed, checkpoint.chunks_committed) == (0, 0)
+    checkpoint.commit_chunk(0)
+    assert (checkpoint.pages_committed, checkpoint.chunks_committed) == (2, 3)
+
+def test_zero_chunk_pages_advance_only_behind_committed_pages():
+    checkpoint = FileCheckpoint("book", "book.pdf")
+    checkpoint.add_page(0, 0)
+    assert (checkpoint.pages_committed, checkpoint.chunks_committed) == (1, 0)
+    checkpoint.add_page(1, 1)
+    checkpoint.add_page(2, 0)
+    assert checkpoint.pages_committed == 1
+    checkpoint.commit_chunk(1)
+    assert (checkpoint.pages_committed, checkpoint.chunks_committed) == (3, 1)
+
+def test_resume_continues_from_start_page_and_first_chunk():
+    checkpoint = FileCheckpoint("book", "book.pdf", start_page=5, first_chunk=12)
+    checkpoint.add_page(6, 1)
+    checkpoint.commit_chunk(6)
+    assert (checkpoint.pages_committed, checkpoint.chunks_committed) == (5, 12)
+    checkpoint.add_page(5, 2)
+    checkpoint.commit_chunk(5)
+    checkpoint.commit_chunk(5)
+    assert (checkpoint.pages_committed, checkpoint.chunks_committed) == (7, 15)
+
+def test_complete_only_after_parsing_finishes_and_every_chunk_commits():
+    checkpoint = FileCheckpoint("book", "book.pdf")
+    checkpoint.add_page(0, 1)
+    checkpoint.parsing_done = True
+    assert not checkpoint.complete
+    checkpoint.commit_chunk(0)
+    assert checkpoint.complete
@@ -0,0 +1,32 @@
+from lexical_index import is_keyword_query
+import pytest
+
+@pytest.mark.parametrize("query", [
+    "Which book did Marcus write about the storm and the harbor?",
+    "What happened in the mid part of the civil war story?",
+    "Why was the captain ill for most of the book I read?",
+    "Which page I liked most in the captain's story?",
+    "What does the book mix together about the river?",
+    "Main characters",
+    "Give me a summary",
+    "Any plot twists?",
+    "The ending",
+    "Key themes please",
+    "Overall tone",
+    "Main Characters",
+    "marcus and the captain",
+])
+def test_natural_language_questions_are_not_keyword_queries(query):
+    assert not is_keyword_query(query)
+
+@pytest.mark.parametrize("query", [
+    "What happens to the captain in chapter 12?",
+    "What happens to the captain in chapter XIV?",
+    "Summarize part iv of the story for me please",
+    "Chapter I",
+    '"silver crown"',
+    "Marcus",
+    "Elena Vance",
+])
+def test_keyword_queries(query):
+    assert is_keyword_query(query)
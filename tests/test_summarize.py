@@ -0,0 +1,22 @@
+from summarize import split_into_sections
+
+def section_titles(chunks):
+    return [(title, indexes) for title, indexes, _ in split_into_sections(chunks)]
+
+def test_prose_starting_with_section_words_does_not_start_sections():
+    chunks = [
+        (0, "Chapter 1\nThe crew rowed out before the storm."),
+        (1, "Part of the crew left at dawn."),
+        (2, "Book lovers gathered at the harbor."),
+        (3, "Chapter 1 continued on the next page."),
+    ]
+    assert section_titles(chunks) == [("Chapter 1", [0, 1, 2, 3])]
+
+def test_headings_with_numerals_number_words_and_titles():
+    chunks = [
+        (0, "Chapter 1\nThe crew rowed out."),
+        (1, "CHAPTER IV: The Storm\nThe wind rose."),
+        (2, "Book Twenty-One\nA new voyage."),
+        (3, "Chapter civil unrest spread."),
+    ]
+    assert section_titles(chunks) == [("Chapter 1", [0]), ("Chapter Iv", [1]), ("Book Twenty-One", [2, 3])]
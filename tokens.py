@@ -0,0 +1,9 @@
+import math
+
+CHARS_PER_TOKEN = 4 # Rough average for English text with the Llama tokenizer.
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens in a piece of text without loading a tokenizer."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
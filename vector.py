@@ -1,70 +1,464 @@
 from langchain_ollama import OllamaEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
+from embedding_cache import CachedEmbeddings
+from session_cache import sessions
+from document_store import DOCUMENT_STORE_DIR, registry, file_fingerprint, make_book_key
+from lexical_index import lexical_indexes, is_keyword_query, quoted_phrases, normalize_text, reciprocal_rank_fusion
+from page_cache import PageCache, PageCacheWriter, has_page_cache, delete_page_cache
+from metrics import span, retrieval_queries
+import chromadb
+from chromadb.api.shared_system_client import SharedSystemClient
 import os
+import re
+import json
+import asyncio
+import time
+import shutil
+import hashlib
+import threading
 
-embeddings = OllamaEmbeddings(model="mxbai-embed-large") # Initializes the Ollama embeddings model.
+EMBEDDING_MODEL = "mxbai-embed-large" # Ollama model used to embed chunks and questions.
 
-def get_vector_store(chat_id: str, pdf_files: list = None):
-    """Initializes or retrieves a Chroma vector store for a given chat_id, loading and adding documents if provided."""
-    db_location_for_chat = f"./chroma_db/{chat_id}" # Defines the unique directory path for the chat's vector store.
+embeddings = CachedEmbeddings( # Initializes the Ollama embeddings model behind a persistent embedding cache.
+    OllamaEmbeddings(model=EMBEDDING_MODEL),
+    model_name=EMBEDDING_MODEL
+)
 
-    db_exists = os.path.exists(db_location_for_chat) # Checks if the vector store directory already exists for the chat.
+CHUNK_SIZE = 1500 # Maximum number of characters per chunk.
+CHUNK_OVERLAP = 300 # Number of characters shared between neighbouring chunks.
+DEFAULT_INDEX_SETTINGS = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "embedding_model": EMBEDDING_MODEL} # Used by chats never re-indexed.
+RETRIEVAL_K = 8 # Chunks returned per query.
+HYBRID_RETRIEVAL_ENABLED = os.environ.get("HYBRID_RETRIEVAL_ENABLED", "1") == "1" # Fuses BM25 results with the vector results.
+LEXICAL_FAST_PATH_ENABLED = os.environ.get("LEXICAL_FAST_PATH_ENABLED", "1") == "1" # Serves keyword-style queries from BM25 alone, skipping the embedding call.
+LEXICAL_CANDIDATES = int(os.environ.get("LEXICAL_CANDIDATES", 20)) # BM25 results fused with the vector results.
+LEGACY_CHECKPOINT_FILENAME = "ingest_checkpoints.json" # Per-chat checkpoints written before books were shared between chats.
+LEGACY_MIGRATION_PAGE_SIZE = 1000 # Chunks copied per read when migrating a per-chat collection.
 
-    text_splitter = RecursiveCharacterTextSplitter( # Instantiates the text splitter for document chunking.
-        chunk_size=1500,
-        chunk_overlap=300
-    )
+embeddings_by_model = {EMBEDDING_MODEL: embeddings} # Cached embedding functions of every model a chat was indexed with.
+embeddings_lock = threading.Lock()
+
+def get_embeddings(embedding_model: str = EMBEDDING_MODEL):
+    """Returns the cached embedding function of an Ollama embedding model."""
+    with embeddings_lock:
+        if embedding_model not in embeddings_by_model:
+            embeddings_by_model[embedding_model] = CachedEmbeddings(OllamaEmbeddings(model=embedding_model), model_name=embedding_model)
+        return embeddings_by_model[embedding_model]
+
+def check_embedding_model(embedding_model: str):
+    """Embeds a short probe text with an Ollama embedding model, raising if the model is unknown or unreachable.
+
+    Bypasses the embedding cache, so a misspelled model name is neither answered from it nor added to it.
+    """
+    OllamaEmbeddings(model=embedding_model).embed_query("embedding model check")
+
+def clear_embedding_caches():
+    """Removes every cached vector and resets the hit and miss counts of every model's embedding function."""
+    embeddings.clear() # All models share one cache database.
+    with embeddings_lock:
+        for model_embeddings in embeddings_by_model.values():
+            model_embeddings.reset_counters()
+
+def embedding_cache_stats():
+    """Returns the embedding cache's size and the default model's counters, with the counters of every model under "models"."""
+    with embeddings_lock:
+        all_embeddings = list(embeddings_by_model.values())
+    stats = embeddings.stats()
+    stats["models"] = {
+        model_stats["model"]: {name: model_stats[name] for name in ("hits", "misses", "hit_rate")}
+        for model_stats in (model_embeddings.stats() for model_embeddings in all_embeddings)
+    }
+    return stats
+
+def uses_lexical_fast_path(query: str):
+    """Returns True if a query is answered from BM25 alone, without embedding it (unless BM25 finds nothing)."""
+    return LEXICAL_FAST_PATH_ENABLED and is_keyword_query(query)
 
-    documents_to_add = [] # Initializes a list to hold documents prepared for addition.
-    ids_to_add = [] # Initializes a list to hold unique IDs for the documents.
-
-    if pdf_files: # Processes PDF files if a list of file paths is provided.
-        for file_path in pdf_files:
-            if file_path.endswith(".pdf") and os.path.exists(file_path):
-                filename = os.path.basename(file_path)
-                print(f"[{chat_id}] Loading {filename} for chunking...")
-                loader = PyPDFLoader(file_path)
-                pages = loader.load_and_split()
-                chunks = text_splitter.split_documents(pages)
-
-                for i, chunk in enumerate(chunks):
-                    doc_id = f"{filename}_{i}"
-                    chunk.metadata["source_file"] = filename
-                    chunk.metadata["chunk"] = i
-                    chunk.metadata["id"] = doc_id
-                    documents_to_add.append(chunk)
-                    ids_to_add.append(doc_id)
-            else:
-                print(f"[{chat_id}] Skipping invalid file: {file_path}")
-
-    vector_store = Chroma( # Initializes or loads the Chroma vector store instance.
-        collection_name=f"chat_{chat_id}_pdfs",
-        persist_directory=db_location_for_chat,
-        embedding_function=embeddings
+def get_chat_settings(chat_id: str):
+    """Returns the chunk size, chunk overlap and embedding model a chat's books are indexed with."""
+    return registry.chat_settings(chat_id) or dict(DEFAULT_INDEX_SETTINGS)
+
+def get_text_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    """Returns the text splitter used to chunk PDF pages."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
     )
 
-    if not db_exists: # Handles the case where the vector store is being created for the first time.
-        if documents_to_add:
-            vector_store.add_documents(documents=documents_to_add, ids=ids_to_add)
-            print(f"[{chat_id}] New vector store created and {len(documents_to_add)} documents added.")
+def get_book_key(fingerprint: str, settings: dict = None):
+    """Returns the document store key of a PDF: its content hash combined with the chunking and embedding settings."""
+    settings = settings or DEFAULT_INDEX_SETTINGS
+    return make_book_key(fingerprint, settings["chunk_size"], settings["chunk_overlap"], settings["embedding_model"])
+
+def book_chunk_id(book_key: str, chunk_index: int):
+    """Returns the document store ID of one chunk of a book."""
+    return f"{book_key[:24]}_{chunk_index}"
+
+def iter_pdf_pages(file_path: str, start_page: int = 0, fingerprint: str = None):
+    """Yields (page index, page document) tuples of a PDF from `start_page` on.
+
+    With a `fingerprint`, pages come from the file's extracted-text cache when it exists, without
+    opening the PDF. Otherwise the PDF is parsed, and every page's text is written to the cache.
+    """
+    if fingerprint and has_page_cache(fingerprint):
+        with PageCache(fingerprint) as pages:
+            for page_index in range(start_page, len(pages)):
+                yield page_index, Document(page_content=pages.page(page_index), metadata={"source": file_path, "page": page_index})
+        return
+
+    writer = PageCacheWriter(fingerprint) if fingerprint else None
+    try:
+        for page_index, page in enumerate(PyPDFLoader(file_path).lazy_load()):
+            if writer:
+                writer.add_page(page.page_content)
+            if page_index >= start_page:
+                yield page_index, page
+    except BaseException:
+        if writer:
+            writer.discard()
+        raise
+    if writer:
+        writer.commit()
+
+def iter_pdf_chunks(file_path: str, start_page: int = 0, first_chunk: int = 0, stage_seconds: dict = None, book_key: str = None,
+                    settings: dict = None, fingerprint: str = None):
+    """Lazily loads a PDF page by page and yields (page index, chunks of that page) tuples.
+
+    Only one page is held in memory at a time. Chunk numbering continues from `first_chunk`, so
+    resuming at `start_page` with the matching chunk count reproduces the same chunk ids. If
+    `stage_seconds` is given, it holds the "load" and "split" times of the page just yielded.
+    With a `book_key`, chunks get document store IDs and are tagged with the book they belong to.
+    `settings` overrides the default chunk size and overlap; a `fingerprint` enables the page text cache.
+    """
+    settings = settings or DEFAULT_INDEX_SETTINGS
+    filename = os.path.basename(file_path)
+    text_splitter = get_text_splitter(settings["chunk_size"], settings["chunk_overlap"])
+    chunk_index = first_chunk
+
+    load_started = time.perf_counter()
+    for page_index, page in iter_pdf_pages(file_path, start_page, fingerprint):
+        split_started = time.perf_counter()
+        chunks = text_splitter.split_documents([page])
+        for chunk in chunks:
+            doc_id = book_chunk_id(book_key, chunk_index) if book_key else f"{filename}_{chunk_index}"
+            chunk.metadata["source_file"] = filename
+            if book_key:
+                chunk.metadata["book"] = book_key
+            chunk.metadata["chunk"] = chunk_index
+            chunk.metadata["id"] = doc_id
+            chunk.metadata["page"] = page_index
+            chunk_index += 1
+        if stage_seconds is not None:
+            stage_seconds["load"] = split_started - load_started
+            stage_seconds["split"] = time.perf_counter() - split_started
+        yield page_index, chunks
+        load_started = time.perf_counter()
+
+def get_chroma_client(persist_directory: str):
+    """Returns the shared Chroma client for a persist directory, creating it on first use."""
+    return sessions.chroma_clients.get_or_create(persist_directory, lambda: chromadb.PersistentClient(path=persist_directory))
+
+def forget_chroma_systems():
+    """Makes chromadb forget its per-path systems so renamed or deleted directories are reopened fresh.
+
+    Clients already held elsewhere keep working; only newly created clients get a new system.
+    """
+    SharedSystemClient.clear_system_cache()
+
+def get_document_collection_name(embedding_model: str = EMBEDDING_MODEL):
+    """Returns the name of the shared collection holding the books embedded with a model."""
+    return "documents_" + re.sub(r"[^a-zA-Z0-9_-]", "_", embedding_model)
+
+def get_document_store(embedding_model: str = EMBEDDING_MODEL):
+    """Returns the Chroma vector store shared by all chats, in which every book embedded with a model is stored once."""
+    return sessions.vector_stores.get_or_create(f"{DOCUMENT_STORE_DIR}:{embedding_model}", lambda: Chroma(
+        collection_name=get_document_collection_name(embedding_model),
+        client=get_chroma_client(DOCUMENT_STORE_DIR),
+        embedding_function=get_embeddings(embedding_model)
+    ))
+
+def get_chat_store(chat_id: str):
+    """Returns the document store holding a chat's books, which depends on the chat's embedding model."""
+    return get_document_store(get_chat_settings(chat_id)["embedding_model"])
+
+def delete_books(books: dict):
+    """Removes books no chat references any more, given as book key -> registry entry, from the document store.
+
+    Their BM25 indexes go too, and so does the page text cache of any file no remaining book was built from.
+    """
+    if not books:
+        return
+    keys_by_model = {}
+    for book_key, book in books.items():
+        keys_by_model.setdefault(book.get("embedding_model", EMBEDDING_MODEL), []).append(book_key)
+    for embedding_model, book_keys in keys_by_model.items():
+        get_document_store(embedding_model)._collection.delete(where={"book": {"$in": book_keys}})
+    lexical_indexes.delete(list(books))
+    for fingerprint in {book.get("fingerprint") for book in books.values()}:
+        if fingerprint and not registry.fingerprint_in_use(fingerprint):
+            delete_page_cache(fingerprint)
+    print(f"Removed {len(books)} unreferenced book(s) from the document store.")
+
+def add_book_to_chat(chat_id: str, filename: str, book_key: str, **book_fields):
+    """References a book from a chat, removing any book the file name no longer points to from the store."""
+    delete_books(registry.add_chat_book(chat_id, filename, book_key, **book_fields))
+
+def get_vector_store(chat_id: str):
+    """Returns the shared document store for a chat, creating the chat's directory. Documents are added by ingest jobs."""
+    db_location_for_chat = f"./chroma_db/{chat_id}" # Defines the chat's directory, which marks the chat as existing and holds its summaries.
+
+    if os.path.exists(db_location_for_chat):
+        print(f"[{chat_id}] Chat already exists. Using the shared document store.")
+    else: # Handles the case where the chat is being created for the first time.
+        os.makedirs(db_location_for_chat, exist_ok=True)
+        print(f"[{chat_id}] New chat initialized (no documents added yet).")
+
+    return get_chat_store(chat_id)
+
+class ChatRetriever(BaseRetriever):
+    """Hybrid retriever over the shared document store, restricted to the books of one chat.
+
+    Vector MMR results and BM25 results are merged by reciprocal rank fusion. Keyword-style queries
+    (quoted phrases, chapter references, short name-like queries) are answered from BM25 alone,
+    without embedding the query, and fall back to the hybrid search when BM25 finds nothing.
+    The chat's books and embedding model are read from the registry on every query, so uploads, renames,
+    deletions and re-indexes take effect without rebuilding the retriever. Retrieved chunks are labelled with the file name
+    the chat uploaded the book as, which may differ from the name it was first indexed under.
+    """
+
+    chat_id: str
+    k: int = RETRIEVAL_K
+
+    @property
+    def vector_store(self):
+        """The document store holding the chat's books, which depends on the model they were embedded with."""
+        return get_chat_store(self.chat_id)
+
+    def search_arguments(self):
+        """Returns the chat's books, their store and the MMR search keyword arguments filtered to them, or (None, None, None) if it has none."""
+        books = registry.chat_books(self.chat_id)
+        if not books:
+            return None, None, None
+        book_filter = {"book": next(iter(books))} if len(books) == 1 else {"book": {"$in": list(books)}}
+        return books, self.vector_store, {"k": self.k, "filter": book_filter}
+
+    def label_sources(self, books, docs):
+        """Sets each chunk's source_file to the chat's name for its book."""
+        for doc in docs:
+            doc.metadata["source_file"] = books.get(doc.metadata.get("book"), doc.metadata.get("source_file"))
+        return docs
+
+    def lexical_search(self, books, store, query, limit):
+        """Returns up to `limit` chunks of the chat's books ranked by BM25. Chunks must contain every quoted phrase of the query."""
+        phrases = quoted_phrases(query)
+        with span("lexical", self.chat_id) as lexical_span:
+            keys = lexical_indexes.search(list(books), query, max(limit, LEXICAL_CANDIDATES) if phrases else limit)
+            docs = self.fetch_chunks(store, keys)
+            if phrases:
+                docs = [doc for doc in docs if all(phrase in normalize_text(doc.page_content) for phrase in phrases)]
+            lexical_span.sizes["chunks"] = len(docs[:limit])
+        return docs[:limit]
+
+    def fetch_chunks(self, store, keys):
+        """Loads chunk documents from the store by (book key, chunk index), in the given order."""
+        if not keys:
+            return []
+        ids = [book_chunk_id(book_key, chunk_index) for book_key, chunk_index in keys]
+        result = store._collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            doc_id: Document(page_content=document, metadata=metadata, id=doc_id)
+            for doc_id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        }
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+    def fast_path(self, books, store, query):
+        """Returns the lexical fast path's results for keyword-style queries, or None if the query needs the vector search."""
+        if not uses_lexical_fast_path(query):
+            return None
+        docs = self.lexical_search(books, store, query, self.k)
+        if not docs:
+            return None
+        retrieval_queries.inc(mode="lexical")
+        return self.label_sources(books, docs)
+
+    def fuse(self, books, vector_docs, lexical_docs):
+        """Merges the vector and BM25 results, or returns the vector results alone if hybrid retrieval is off."""
+        retrieval_queries.inc(mode="hybrid" if HYBRID_RETRIEVAL_ENABLED else "vector")
+        docs = reciprocal_rank_fusion([vector_docs, lexical_docs], self.k) if HYBRID_RETRIEVAL_ENABLED else vector_docs
+        return self.label_sources(books, docs)
+
+    def retrieve(self, query, vector=None):
+        """Returns the chunks for a query. A batch can pass each query's embedding, computed in one call, as `vector`."""
+        books, store, search_kwargs = self.search_arguments()
+        if not books:
+            return []
+        docs = self.fast_path(books, store, query)
+        if docs is not None:
+            return docs
+        if vector is None:
+            vector_docs = store.max_marginal_relevance_search(query, **search_kwargs)
         else:
-            print(f"[{chat_id}] New vector store initialized (no documents added yet).")
-    elif documents_to_add: # Handles adding new documents to an existing vector store.
-        vector_store.add_documents(documents=documents_to_add, ids=ids_to_add)
-        print(f"[{chat_id}] {len(documents_to_add)} new documents added to existing vector store.")
-    else: # Handles loading an existing vector store when no new documents are provided.
-        print(f"[{chat_id}] Vector store already exists. Loading existing store.")
+            vector_docs = store.max_marginal_relevance_search_by_vector(vector, **search_kwargs)
+        lexical_docs = self.lexical_search(books, store, query, LEXICAL_CANDIDATES) if HYBRID_RETRIEVAL_ENABLED else []
+        return self.fuse(books, vector_docs, lexical_docs)
 
-    return vector_store
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.retrieve(query)
 
-def get_retriever(chat_id: str, pdf_files: list = None):
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        books, store, search_kwargs = self.search_arguments()
+        if not books:
+            return []
+        docs = await asyncio.to_thread(self.fast_path, books, store, query)
+        if docs is not None:
+            return docs
+        vector_search = store.amax_marginal_relevance_search(query, **search_kwargs)
+        if not HYBRID_RETRIEVAL_ENABLED:
+            return self.fuse(books, await vector_search, [])
+        vector_docs, lexical_docs = await asyncio.gather(
+            vector_search, asyncio.to_thread(self.lexical_search, books, store, query, LEXICAL_CANDIDATES)
+        )
+        return self.fuse(books, vector_docs, lexical_docs)
+
+def get_retriever(chat_id: str):
     """Returns a configured retriever for a given chat_id, creating the vector store if necessary."""
-    vector_store = get_vector_store(chat_id, pdf_files)
-    retriever = vector_store.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": 8}
+    get_vector_store(chat_id)
+    return ChatRetriever(chat_id=chat_id)
+
+def list_chat_sources(chat_id: str):
+    """Returns the sorted names of the source files indexed into a chat."""
+    return sorted(
+        filename for book_key, filename in registry.chat_books(chat_id).items()
+        if (registry.get_book(book_key) or {}).get("chunks_committed")
     )
-    return retriever
\ No newline at end of file
+
+def get_source_chunks(chat_id: str, source_file: str):
+    """Returns every stored chunk of one source file in a chat as (chunk index, text) tuples, in document order."""
+    book_key = next((key for key, filename in registry.chat_books(chat_id).items() if filename == source_file), None)
+    if book_key is None:
+        return []
+    result = get_chat_store(chat_id)._collection.get(where={"book": book_key}, include=["documents", "metadatas"])
+    chunks = [(metadata.get("chunk", 0), document) for document, metadata in zip(result["documents"], result["metadatas"])]
+    return sorted(chunks, key=lambda chunk: chunk[0])
+
+def load_legacy_checkpoints(chat_dir: str):
+    """Loads the per-chat ingestion checkpoints of a chat created before the document store, keyed by file name."""
+    path = os.path.join(chat_dir, LEGACY_CHECKPOINT_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading legacy checkpoints from {path}: {e}")
+        return {}
+
+def migrate_legacy_chat(chat_id: str, collection):
+    """Copies one chat's own collection into the document store, book by book, and registers the chat's books.
+
+    Books the store already holds completely are only referenced. Embeddings are copied as they are,
+    so no chunk is embedded again. Returns the number of chunks copied.
+    """
+    chat_dir = f"./chroma_db/{chat_id}"
+    checkpoints = load_legacy_checkpoints(chat_dir)
+    store = get_document_store()._collection
+    book_keys = {} # Maps file name -> book key.
+    fingerprints = {} # Maps file name -> SHA-256 of the upload.
+    chunk_counts = {}
+    copied = 0
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas", "embeddings"], limit=LEGACY_MIGRATION_PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        ids, vectors, documents, metadatas = [], [], [], []
+        for document, metadata, vector in zip(page["documents"], page["metadatas"], page["embeddings"]):
+            filename = metadata.get("source_file", "unknown")
+            if filename not in book_keys:
+                upload_path = os.path.join(f"./uploaded_pdfs/{chat_id}", filename)
+                fingerprints[filename] = file_fingerprint(upload_path) if os.path.exists(upload_path) else \
+                    hashlib.sha256(f"legacy:{chat_id}:{filename}".encode("utf-8")).hexdigest()
+                book_keys[filename] = get_book_key(fingerprints[filename])
+            book_key = book_keys[filename]
+            chunk_counts[book_key] = chunk_counts.get(book_key, 0) + 1
+            if (registry.get_book(book_key) or {}).get("complete"):
+                continue
+            metadata = dict(metadata, book=book_key, id=book_chunk_id(book_key, metadata.get("chunk", 0)))
+            ids.append(metadata["id"])
+            vectors.append(vector)
+            documents.append(document)
+            metadatas.append(metadata)
+        if ids:
+            store.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+            lexical_indexes.add_chunks([Document(page_content=document, metadata=metadata) for document, metadata in zip(documents, metadatas)])
+            copied += len(ids)
+
+    for filename, book_key in book_keys.items():
+        add_book_to_chat(chat_id, filename, book_key, fingerprint=fingerprints[filename], embedding_model=EMBEDDING_MODEL)
+        if (registry.get_book(book_key) or {}).get("complete"):
+            continue
+        checkpoint = checkpoints.get(filename)
+        if checkpoint and not checkpoint.get("complete"):
+            registry.update_book(book_key, pages_committed=checkpoint.get("pages_committed", 0),
+                                 chunks_committed=checkpoint.get("chunks_committed", 0), complete=False, updated_at=time.time())
+        else:
+            registry.update_book(book_key, chunks_committed=chunk_counts[book_key], complete=True, updated_at=time.time())
+    return copied
+
+def migrate_legacy_chats():
+    """Moves chats that still have their own Chroma collection into the shared document store.
+
+    The chat directories are kept, as they mark the chat as existing, but their Chroma files are
+    removed once every chunk has been copied. Returns the IDs of the migrated chats.
+    """
+    migrated = []
+    if not os.path.exists("./chroma_db"):
+        return migrated
+    for chat_id in sorted(os.listdir("./chroma_db")):
+        chat_dir = f"./chroma_db/{chat_id}"
+        if not os.path.exists(os.path.join(chat_dir, "chroma.sqlite3")):
+            continue
+        try:
+            client = chromadb.PersistentClient(path=chat_dir)
+            try:
+                collection = client.get_collection(f"chat_{chat_id}_pdfs")
+            except Exception:
+                collection = None # The chat never had documents indexed.
+            copied = migrate_legacy_chat(chat_id, collection) if collection is not None else 0
+        except Exception as e:
+            print(f"[{chat_id}] Error migrating chat into the document store: {e}")
+            continue
+        migrated.append(chat_id)
+        print(f"[{chat_id}] Migrated into the document store ({copied} chunks copied).")
+
+    if migrated:
+        for chat_id in migrated: # Releases the per-chat clients before their files are removed.
+            sessions.chroma_clients.pop(f"./chroma_db/{chat_id}")
+        forget_chroma_systems()
+        for chat_id in migrated:
+            chat_dir = f"./chroma_db/{chat_id}"
+            for name in os.listdir(chat_dir):
+                path = os.path.join(chat_dir, name)
+                if name == "chroma.sqlite3" or name == LEGACY_CHECKPOINT_FILENAME:
+                    os.remove(path)
+                elif os.path.isdir(path): # Chroma's segment directories.
+                    shutil.rmtree(path)
+    return migrated
+
+def build_missing_lexical_indexes():
+    """Builds the BM25 index of every stored book that has chunks but no index yet, from the chunks in the store. Returns the book keys."""
+    built = []
+    for book_key in registry.book_keys():
+        if os.path.exists(lexical_indexes.get_path(book_key)) or not (registry.get_book(book_key) or {}).get("chunks_committed"):
+            continue
+        embedding_model = (registry.get_book(book_key) or {}).get("embedding_model", EMBEDDING_MODEL)
+        result = get_document_store(embedding_model)._collection.get(where={"book": book_key}, include=["documents", "metadatas"])
+        lexical_indexes.add_chunks([Document(page_content=document, metadata=metadata) for document, metadata in zip(result["documents"], result["metadatas"])])
+        built.append(book_key)
+    if built:
+        print(f"Built BM25 indexes for {len(built)} book(s).")
+    return built